@@ -0,0 +1,214 @@
+# Пакетный запуск программ в симуляторе на пуле процессов.
+# Программы связываются один раз в основном процессе, каждая — в свой файл
+# образа памяти (разреженный, на всё адресное пространство). Задание
+# передаётся в процесс как пути к модулям и небольшое начальное состояние;
+# процесс отображает файл образа с копированием при записи, так что
+# страницы программы общие для всех процессов и заданий, а копируются
+# только те, в которые задание пишет.
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from loader import *
+from simulator import REGISTERS, WORD_MASK, RunResult
+from block_compiler import BlockSimulator
+
+
+@dataclass(slots=True)
+class Job:
+    # Объектные модули (двоичные или текстовые) в порядке связывания
+    modules: Tuple[str, ...]
+    name: str = ""
+    # Адрес загрузки программы
+    start: int = 0
+    # Начальные значения регистров: номер -> значение
+    registers: Dict[int, int] = field(default_factory=dict)
+    # Начальные данные в памяти: (адрес, байты), пишутся после загрузки
+    memory: List[Tuple[int, bytes]] = field(default_factory=list)
+    max_steps: int = 1_000_000
+    # Участок памяти для свёртки (адрес, длина); по умолчанию — образ программы
+    digest_range: Tuple[int, int] | None = None
+
+
+@dataclass(slots=True)
+class JobResult:
+    name: str
+    halted: bool
+    steps: int
+    pc: int
+    error: str | None
+    registers: List[int]
+    registers_digest: str
+    memory_digest: str
+    # Время подготовки образа и исполнения
+    timings: Dict[str, float]
+    pid: int
+
+
+@dataclass(slots=True)
+class Program:
+    """Программа, связанная в файл образа памяти"""
+
+    path: str
+    entry: int | None
+    errors: List[str]
+    # Длина программы с адреса загрузки
+    length: int
+
+
+def prelink(modules: Tuple[str, ...], start: int, path: str) -> Program:
+    """Связывание модулей прямо в файл образа path"""
+    with MemoryImage(path) as image:
+        try:
+            result = load_modules(modules, start, image)
+        except (OSError, ValueError, IndexError) as e:
+            return Program(path, None, [str(e)], 0)
+        length = len(result.memory)
+        if isinstance(result.memory, memoryview):
+            result.memory.release()
+        image.flush()
+    return Program(path, result.entry, result.errors, length)
+
+
+# Состояние процесса: задаётся инициализатором пула
+_op_table: Dict[str, Tuple[int, int]] = {}
+_simulator: type = BlockSimulator
+# (модули, адрес загрузки) -> связанная программа
+_programs: Dict[Tuple[Tuple[str, ...], int], Program] = {}
+
+
+def _init_worker(
+    op_table: Dict[str, Tuple[int, int]],
+    simulator: type,
+    programs: Dict[Tuple[Tuple[str, ...], int], Program],
+) -> None:
+    global _op_table, _simulator, _programs
+    _op_table = op_table
+    _simulator = simulator
+    _programs = programs
+
+
+def _run_job(job: Job) -> JobResult:
+    begin = perf_counter()
+    if (program := _programs.get((tuple(job.modules), job.start))) is None:
+        modules = ", ".join(job.modules)
+        raise ValueError(f"Модули {modules} не связаны: задания исполняются через run_batch")
+    with MemoryImage(program.path, private=True) as image:
+        for adr, data in job.memory:
+            image.load(adr, data)
+        cpu = _simulator(image, _op_table)
+        for number, value in job.registers.items():
+            cpu.registers[number] = value & WORD_MASK
+        load_time = perf_counter() - begin
+
+        if program.errors:
+            result = RunResult(job.start, 0, 0.0, False, "; ".join(program.errors))
+        else:
+            entry = job.start if program.entry is None else program.entry
+            result = cpu.run(entry, job.max_steps)
+
+        adr, length = job.digest_range or (job.start, program.length)
+        memory_digest = hashlib.sha256(image.slice(adr, length)).hexdigest()
+    registers = list(cpu.registers)
+    registers_digest = hashlib.sha256(
+        b"".join(value.to_bytes(3, "big") for value in registers)
+    ).hexdigest()
+    return JobResult(
+        job.name,
+        result.halted,
+        result.steps,
+        result.pc,
+        result.error,
+        registers,
+        registers_digest,
+        memory_digest,
+        {"load": load_time, "run": result.elapsed},
+        os.getpid(),
+    )
+
+
+def run_job(job: Job) -> JobResult:
+    """Исполнение одного задания в текущем процессе. Ошибка задания (плохие
+    начальные данные, недоступный образ) возвращается в error и не прерывает
+    остальной пакет"""
+    try:
+        return _run_job(job)
+    # Любая ошибка: исключение из executor.map потеряло бы результаты пакета
+    except Exception as e:
+        return JobResult(
+            job.name, False, 0, job.start, f"{type(e).__name__}: {e}",
+            [0] * REGISTERS, "", "", {"load": 0.0, "run": 0.0}, os.getpid(),
+        )
+
+
+@dataclass(slots=True)
+class BatchReport:
+    results: List[JobResult]
+    workers: int
+    elapsed: float
+    # Время связывания программ (входит в elapsed)
+    link: float = 0.0
+
+    @property
+    def steps(self) -> int:
+        return sum(result.steps for result in self.results)
+
+    @property
+    def failed(self) -> List[JobResult]:
+        return [result for result in self.results if result.error is not None]
+
+    def lines(self) -> List[str]:
+        """Текстовый отчёт: строка на задание и итог"""
+        lines = [
+            f"{result.name or i:<12} {'HALT' if result.halted else 'STOP'} "
+            f"{result.steps:>10} {result.pc:06X} "
+            f"R {result.registers_digest[:16]} M {result.memory_digest[:16]} "
+            f"{result.timings['run'] * 1000:8.1f}мс"
+            + (f" {result.error}" if result.error else "")
+            for i, result in enumerate(self.results)
+        ]
+        jobs_per_second = len(self.results) / self.elapsed if self.elapsed else 0.0
+        lines.append(
+            f"Заданий {len(self.results)}, ошибок {len(self.failed)}, "
+            f"процессов {self.workers}, {self.steps} команд за {self.elapsed:.2f}с "
+            f"(связывание {self.link:.2f}с), "
+            f"{jobs_per_second:.1f} заданий/с"
+        )
+        return lines
+
+
+def run_batch(
+    jobs: Iterable[Job],
+    op_table: Dict[str, Tuple[int, int]],
+    workers: int | None = None,
+    simulator: type = BlockSimulator,
+    chunk_size: int | None = None,
+) -> BatchReport:
+    """Исполнение заданий в пуле процессов, результаты в порядке заданий.
+    С workers=1 задания выполняются в текущем процессе."""
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    begin = perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        programs = {}
+        for job in jobs:
+            key = (tuple(job.modules), job.start)
+            if key not in programs:
+                path = os.path.join(directory, f"program{len(programs)}.img")
+                programs[key] = prelink(key[0], job.start, path)
+        link = perf_counter() - begin
+        if workers == 1:
+            _init_worker(op_table, simulator, programs)
+            results = [run_job(job) for job in jobs]
+        else:
+            # Несколько порций на процесс, чтобы выровнять нагрузку
+            chunk_size = chunk_size or max(1, len(jobs) // (workers * 4))
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(op_table, simulator, programs),
+            ) as executor:
+                results = list(executor.map(run_job, jobs, chunksize=chunk_size))
+    return BatchReport(results, workers, perf_counter() - begin, link)
@@ -0,0 +1,863 @@
+# Замеры производительности ассемблера.
+# Запуск: python benchmarks.py [имя_замера ...]
+import sys
+from collections import deque
+from time import perf_counter
+
+from parser import *
+from parse_cache import ParseCache
+from first_pass import *
+from object_file import *
+from loader import *
+from memory_image import *
+from simulator import *
+from block_compiler import BlockSimulator
+from profiler import Profile, hot_spot_report
+from batch import Job, run_batch
+
+OP_TABLE = {
+    "ADD": (1, 2),
+    "SUB": (2, 2),
+    "LOAD": (3, 4),
+    "STORE": (4, 4),
+    "JMP": (5, 3),
+    "NOP": (6, 1),
+}
+
+
+def synthetic_source(lines: int) -> str:
+    """Программа из повторяющихся типичных строк заданной длины"""
+    body = [
+        "ADD R1, R2",
+        "LOOP: LOAD 0x1F ; комментарий",
+        "STORE DATA",
+        "JMP @LOOP",
+        "BYTE c'hello, world'",
+        "WORD x'0A0B0C'",
+        "",
+        "SUB -15",
+    ]
+    src = ["PROG: START 0"]
+    src.extend(body[i % len(body)] for i in range(lines))
+    src.append("END")
+    return "\n".join(src)
+
+
+def synthetic_program(lines: int) -> str:
+    """Корректная для первого прохода программа с уникальными метками"""
+    src = ["PROG: START 0"]
+    for i in range(lines // 6):
+        src.append(f"L{i}: ADD R1, R2")
+        src.append(f"LOAD L{i}")
+        src.append(f"JMP @L{i}")
+        src.append("BYTE 7")
+        src.append("WORD 300")
+        src.append("RESB 2")
+    src.append("END")
+    return "\n".join(src)
+
+
+def forward_ref_program(refs: int) -> str:
+    """Программа, где каждая ссылка указывает вперёд: половина на свои метки,
+    половина на одну общую метку в конце"""
+    src = ["PROG: START 0"]
+    half = refs // 2
+    for i in range(half):
+        src.append(f"LOAD F{i}")
+        src.append("JMP @LAST")
+    src.extend(f"F{i}: NOP" for i in range(half))
+    src.append("LAST: NOP")
+    src.append("END")
+    return "\n".join(src)
+
+
+# Таблица кодов для симулятора: у 2-байтных команд операнды — регистры
+SIM_OP_TABLE = {
+    "LOADI": (1, 4),
+    "LOAD": (2, 4),
+    "STORE": (3, 4),
+    "ADD": (4, 2),
+    "MOV": (5, 2),
+    "COMP": (6, 4),
+    "JLT": (7, 3),
+    "JMP": (8, 4),
+    "HALT": (9, 1),
+}
+
+
+def counting_loop_program(iterations: int) -> str:
+    """Цикл из трёх команд: R0 растёт на R1 = 1 до значения слова N"""
+    return "\n".join([
+        "P: START 0",
+        "LOADI 1",
+        "MOV R1, R0",
+        "LOADI 0",
+        "LOOP: ADD R0, R1",
+        "COMP N",
+        "JLT @LOOP",
+        "STORE RES",
+        "HALT",
+        f"N: WORD {iterations}",
+        "RES: RESW 1",
+        "END",
+    ])
+
+
+def random_machine_code(rng, size: int = 96) -> bytes:
+    """Случайный код для SIM_OP_TABLE с переходами назад и записями, в том
+    числе за границу образа на 4 КБ"""
+    def op(mnemonic, mode=0):
+        return bytes([SIM_OP_TABLE[mnemonic][0] << 2 | mode])
+
+    code = bytearray()
+    while len(code) < size:
+        adr = len(code)
+        kind = rng.randrange(8)
+        if kind == 0:
+            code += op("LOADI") + rng.randrange(50).to_bytes(3, "big")
+        elif kind in (1, 2):
+            registers = rng.randrange(4) << 4 | rng.randrange(4)
+            code += op(rng.choice(("ADD", "MOV"))) + bytes([registers])
+        elif kind == 3:
+            code += op(rng.choice(("COMP", "LOAD")), 1) + rng.randrange(200, 256).to_bytes(3, "big")
+        elif kind == 4:
+            code += op("STORE", 1) + rng.choice((200, 250, 4094)).to_bytes(3, "big")
+        elif kind in (5, 6):
+            offset = (rng.randrange(adr + 1) - (adr + 3)) & 0xFFFF
+            code += op("JLT", 2) + offset.to_bytes(2, "big")
+        else:
+            code += op("JMP", 1) + rng.randrange(adr + 1).to_bytes(3, "big")
+    return bytes(code + op("HALT"))
+
+
+def load_text_records(lines: List[str]) -> bytearray:
+    """Простейшая загрузка T-записей текстового модуля в память"""
+    memory = bytearray()
+    for line in lines:
+        if not line.startswith("T"):
+            continue
+        _, adr, _, *data = line.split(" ")
+        chunk = bytes.fromhex(data[0]) if data else b""
+        adr = int(adr, 16)
+        if adr + len(chunk) > len(memory):
+            memory.extend(bytes(adr + len(chunk) - len(memory)))
+        memory[adr : adr + len(chunk)] = chunk
+    return memory
+
+
+def synthetic_modules(sections: int) -> str:
+    """Цепочка секций: каждая экспортирует своё имя и ссылается на соседнюю"""
+    src = []
+    for i in range(sections):
+        src.append(f"S{i}: START 0" if i == 0 else f"S{i}: CSECT")
+        src.append(f"EXTDEF E{i}")
+        src.append(f"EXTREF E{(i + 1) % sections}")
+        src.append(f"E{i}: LOAD E{(i + 1) % sections}")
+        src.append(f"L{i}: LOAD L{i}")
+        src.append("WORD 5")
+        src.append("RESB 3")
+        src.append("NOP")
+    src.append("END")
+    return "\n".join(src)
+
+
+def timed(fn, *args):
+    start = perf_counter()
+    res = fn(*args)
+    return perf_counter() - start, res
+
+
+def bench_fast_path(lines: int = 100_000):
+    src = synthetic_source(lines).split("\n")
+
+    def slow():
+        return [line_parser.parse(line) for line in src]
+
+    def fast():
+        return [parse_line(line) for line in src]
+
+    t_slow, expected = timed(slow)
+    t_fast, got = timed(fast)
+    assert got == expected, "быстрый разбор расходится с грамматикой"
+    print(f"fast_path: {lines} строк, parsec {t_slow:.2f}с, "
+          f"быстрый {t_fast:.2f}с, ускорение x{t_slow / t_fast:.1f}")
+
+
+def bench_parallel(lines: int = 1_000_000):
+    src = synthetic_source(lines)
+    t_single, expected = timed(parse_assembly, src)
+    t_parallel, got = timed(parse_assembly_parallel, src)
+    assert got == expected, "параллельный разбор расходится с последовательным"
+    print(f"parallel: {lines} строк, 1 процесс {t_single:.2f}с, "
+          f"пул {t_parallel:.2f}с, ускорение x{t_single / t_parallel:.1f}")
+
+
+def bench_parse_cache(lines: int = 200_000):
+    import tempfile
+
+    src = synthetic_source(lines)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(directory)
+        t_cold, expected = timed(cache.parse, src)
+        t_warm, got = timed(cache.parse, src)
+    assert got == expected, "кэш вернул другой результат разбора"
+    print(f"parse_cache: {lines} строк, разбор {t_cold:.2f}с, "
+          f"из кэша {t_warm:.2f}с, ускорение x{t_cold / t_warm:.1f}")
+
+    # Запись не сканирует каталог: её цена не зависит от числа записей
+    def store_time(cache, stores: int = 200) -> float:
+        begin = perf_counter()
+        for i in range(stores):
+            cache.store(f"new{i}", [], [f"ошибка {i}"])
+        return (perf_counter() - begin) / stores
+
+    timings = {}
+    for entries in (10, 5_000):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ParseCache(directory)
+            for i in range(entries):
+                cache.store(f"old{i}", [], [f"ошибка {i}"])
+            timings[entries] = store_time(ParseCache(directory))
+    assert timings[5_000] < 5 * timings[10], timings
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(directory, max_bytes=20_000)
+        store_time(cache, 1_000)
+        on_disk = sum(entry.stat().st_size for entry in os.scandir(directory))
+        assert cache.total == on_disk <= cache.max_bytes, (cache.total, on_disk)
+    print(f"parse_cache: запись в кэш из 10 записей {timings[10] * 1e6:.0f}мкс, "
+          f"из 5000 записей {timings[5_000] * 1e6:.0f}мкс")
+
+
+def bench_incremental(lines: int = 50_000, edits: int = 200):
+    timings = {}
+    for size in (lines // 10, lines):
+        src = synthetic_source(size).split("\n")
+        parser = IncrementalParser()
+        parser.update("\n".join(src))
+        middle = size // 2
+        begin = perf_counter()
+        for i in range(edits):
+            # Набор в одной строке: замена строки, затем вставка и удаление
+            parser.edit(middle, 1, [f"ADD R{i % 10}, R2"])
+            parser.edit(middle, 0, ["BAD ,,"])
+            parser.edit(middle, 1, [])
+        timings[size] = (perf_counter() - begin) / (3 * edits)
+        src[middle] = f"ADD R{(edits - 1) % 10}, R2"
+        assert (parser.results, parser.errors) == parse_assembly("\n".join(src)), \
+            "инкрементальный разбор расходится с полным"
+    print("incremental: правка строки " + ", ".join(
+        f"{size} строк {t * 1e6:.0f}мкс" for size, t in timings.items()
+    ))
+
+    # Вставка строки у начала файла с ошибкой в каждой второй строке: номера
+    # строк ошибок ниже правки не переписываются
+    error_timings = {}
+    for size in (lines // 10, lines):
+        src = ["BAD ,," if i % 2 else "ADD R1, R2" for i in range(size)]
+        parser = IncrementalParser()
+        parser.update("\n".join(src))
+        begin = perf_counter()
+        for i in range(edits):
+            parser.edit(1, 0, ["NOP"])
+            parser.edit(1, 1, [])
+        error_timings[size] = (perf_counter() - begin) / (2 * edits)
+        assert (parser.results, parser.errors) == parse_assembly("\n".join(src))
+    assert error_timings[lines] < 5 * error_timings[lines // 10], error_timings
+    print("incremental: правка у начала, ошибка в каждой второй строке " + ", ".join(
+        f"{size} строк {t * 1e6:.0f}мкс" for size, t in error_timings.items()
+    ))
+
+
+def bench_memory(lines: int = 1_000_000):
+    import tracemalloc
+
+    # Разбор без разделения: обычные dataclass с __dict__, свои экземпляры
+    # операндов и неинтернированные строки в каждой строке
+    @dataclass
+    class PlainOperand:
+        value: Any
+
+    @dataclass
+    class PlainCommand:
+        mnemonic: str
+        operands: List[PlainOperand]
+
+    @dataclass
+    class PlainLine:
+        label: str
+        command: PlainCommand
+
+    def fresh(value):
+        return value.encode().decode() if isinstance(value, str) else value
+
+    def plain(parsed):
+        return [
+            PlainLine(fresh(line.label), PlainCommand(
+                fresh(line.command.mnemonic),
+                [PlainOperand(fresh(getattr(op, op.__slots__[0])))
+                 for op in line.command.operands],
+            ))
+            for line in parsed
+        ]
+
+    def traced(fn, *args):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(*args)
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return result, size
+
+    src = synthetic_source(lines)
+    (parsed, _), size = traced(parse_assembly, src)
+    copy, plain_size = traced(plain, parsed)
+    per_line, plain_per_line = size / len(parsed), plain_size / len(copy)
+
+    registers = [op for line in parsed for op in line.command.operands if isinstance(op, Register)]
+    assert all(op is registers[0] for op in registers if op == registers[0]), \
+        "регистры не разделяются между строками"
+    names = [op.data for line in parsed for op in line.command.operands
+             if isinstance(op, (Identifier, RelativeIdentifier))]
+    assert len(names) > 1 and all(name is sys.intern(name) for name in names), \
+        "имена не интернированы"
+    assert len({id(name) for name in names}) == len(set(names))
+    assert per_line < 0.9 * plain_per_line, \
+        f"память на строку не уменьшилась: {per_line:.0f} и {plain_per_line:.0f} байт"
+    print(f"memory: {lines} строк, {per_line:.0f} байт на строку, без разделения "
+          f"{plain_per_line:.0f} байт (x{plain_per_line / per_line:.1f})")
+
+
+def bench_dispatch(lines: int = 120_000):
+    parsed, _ = parse_assembly(synthetic_program(lines))
+    dispatch = {mnemonic: INSTRUCTION for mnemonic in OP_TABLE}
+    dispatch.update(DIRECTIVES)
+
+    def resolve():
+        return [dispatch.get(line.command.mnemonic, UNKNOWN_COMMAND) for line in parsed]
+
+    def assemble():
+        return deque(first_pass_simple_dict(parsed, OP_TABLE, 2), maxlen=1)[-1]
+
+    t_dispatch, _ = timed(resolve)
+    t_pass, (table, _, errors) = timed(assemble)
+    assert not errors, errors
+    print(f"dispatch: {len(parsed)} строк, выбор обработчика "
+          f"{t_dispatch / len(parsed) * 1e6:.2f}мкс/строка, "
+          f"весь проход {t_pass / len(parsed) * 1e6:.1f}мкс/строка")
+
+
+def bench_trace(lines: int = 60_000):
+    parsed, _ = parse_assembly(synthetic_program(lines))
+
+    def drain():
+        steps = 0
+        for _ in first_pass_simple_dict(parsed, OP_TABLE, 2, trace=True):
+            steps += 1
+        return steps
+
+    t_trace, steps = timed(drain)
+    t_plain, _ = timed(lambda: list(first_pass_simple_dict(parsed, OP_TABLE, 2)))
+    print(f"trace: {steps} шагов за {t_trace:.2f}с, без трассировки {t_plain:.2f}с")
+
+
+def bench_forward_refs(refs: int = 100_000):
+    parsed, _ = parse_assembly(forward_ref_program(refs))
+
+    def assemble():
+        return deque(first_pass_simple_dict(parsed, OP_TABLE, 2), maxlen=1)[-1]
+
+    t_pass, (table, _, errors) = timed(assemble)
+    assert not errors, errors[:5]
+    assert isinstance(parsed[1].command.operands[0], Identifier), \
+        "исправления изменили разобранные строки"
+    assert table[1] == f"T 000000 4 0D{7 * (refs // 2):06X}", table[1]
+    print(f"forward_refs: {refs} ссылок вперёд, проход {t_pass:.2f}с, "
+          f"{t_pass / refs * 1e6:.2f}мкс/ссылка")
+
+
+def bench_symbols(symbols: int = 200_000):
+    import tracemalloc
+
+    names = [f"S{i}" for i in range(symbols)]
+
+    def as_dicts():
+        return {"PROG": {name: {"type": None, "addr": i} for i, name in enumerate(names)}}
+
+    def as_table():
+        table = SymbolTable()
+        table.open_section("PROG")
+        for i, name in enumerate(names):
+            table.add(Symbol(name, "PROG", addr=i))
+        return table
+
+    def memory(build):
+        tracemalloc.start()
+        table = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return table, size
+
+    old, old_size = memory(as_dicts)
+    new, new_size = memory(as_table)
+    # Проходы держат словарь текущей секции и ищут имя прямо в нём;
+    # у словарей на каждый операнд был поиск секции и поле записи
+    section = new.sections["PROG"]
+    t_old = min(timed(lambda: [old["PROG"][name]["addr"] for name in names])[0]
+                for _ in range(5))
+    t_new = min(timed(lambda: [section[name].addr for name in names])[0] for _ in range(5))
+    assert t_new <= t_old, f"поиск в SymbolTable медленнее словарей: {t_new:.3f}с и {t_old:.3f}с"
+    print(f"symbols: {symbols} имён, словари {old_size / symbols:.0f} байт/имя, "
+          f"SymbolTable {new_size / symbols:.0f} байт/имя; поиск адреса "
+          f"{t_old / symbols * 1e9:.0f}нс и {t_new / symbols * 1e9:.0f}нс")
+
+
+def bench_resolution(refs: int = 200_000):
+    table = SymbolTable()
+    table.open_section("PROG")
+    table.add(Symbol("EXT", "PROG", SymbolType.EXTREF))
+    ops = [Identifier(f"F{i}") for i in range(refs)]
+    symbols = table.sections["PROG"]
+
+    def with_exceptions():
+        pending = 0
+        for op in ops:
+            try:
+                op.resolve_value(symbols)
+            except KeyError:
+                pending += 1
+        return pending
+
+    def tagged():
+        return sum(op.resolve(symbols).kind == ResolutionKind.PENDING for op in ops)
+
+    t_exc, expected = timed(with_exceptions)
+    t_tagged, got = timed(tagged)
+    assert got == expected == refs
+    # Результаты без значения общие, а не новые на каждый операнд
+    assert ops[0].resolve(symbols) is ops[0].resolve(symbols)
+    assert Identifier("EXT").resolve(symbols) is EXTERNAL
+    assert RelativeIdentifier("EXT").resolve(symbols) is RELATIVE_EXTERNAL
+
+    # Определённые имена: частый путь отдаёт число без Resolution, не медленнее
+    # прежнего resolve_value на словарях
+    for i in range(refs):
+        table.add(Symbol(f"D{i}", "PROG", addr=i))
+    defined = [Identifier(f"D{i}") for i in range(refs)]
+    dicts = {"PROG": {f"D{i}": {"type": None, "addr": i} for i in range(refs)}}
+
+    def dict_value(op):
+        try:
+            record = dicts["PROG"][op.data]
+            if record["type"] == "EXTREF":
+                return 0
+            if record["addr"] is None:
+                raise KeyError()
+            return record["addr"]
+        except:
+            raise KeyError(f"Неизвестное символическое имя {op.data}")
+
+    t_dicts = min(timed(lambda: [dict_value(op) for op in defined])[0] for _ in range(5))
+    t_value = min(timed(lambda: [op.resolve_value(symbols) for op in defined])[0]
+                  for _ in range(5))
+    t_operands, (vals, unresolved) = timed(resolve_operands, defined, symbols)
+    assert unresolved is None and vals == list(range(refs))
+    assert t_value <= t_dicts, f"resolve_value медленнее словарей: {t_value:.3f}с и {t_dicts:.3f}с"
+    print(f"resolution: {refs} неопределённых имён, исключения "
+          f"{t_exc / refs * 1e9:.0f}нс, Resolution {t_tagged / refs * 1e9:.0f}нс; "
+          f"определённые: словари {t_dicts / refs * 1e9:.0f}нс, "
+          f"resolve_value {t_value / refs * 1e9:.0f}нс, "
+          f"resolve_operands {t_operands / refs * 1e9:.0f}нс")
+
+
+def bench_object_code(lines: int = 120_000):
+    parsed, _ = parse_assembly(synthetic_program(lines))
+    records = []
+    deque(first_pass_simple_dict(parsed, OP_TABLE, 2, records=records), maxlen=1)
+
+    t_text, text = timed(lambda: [str(record) for record in records])
+    t_bytes, sections = timed(build_sections, records)
+    t_render, rendered = timed(lambda: [l for s in sections for l in s.text_records()])
+    assert sorted(rendered) == sorted(text), "текст из байтов расходится с записями"
+    size = sum(len(section.code) for section in sections)
+    print(f"object_code: {len(records)} записей, текст {t_text:.2f}с, "
+          f"bytearray {t_bytes:.2f}с ({size} байт), текст из байтов {t_render:.2f}с")
+
+
+def bench_coalesce(lines: int = 120_000):
+    parsed, _ = parse_assembly(synthetic_program(lines))
+    records = []
+    deque(first_pass_simple_dict(parsed, OP_TABLE, 2, records=records), maxlen=1)
+    sections = build_sections(records)
+
+    before = write_object_text(sections, None)
+    after = write_object_text(sections)
+    t_before, expected = timed(load_text_records, before)
+    t_after, got = timed(load_text_records, after)
+    assert got == expected, "упаковка T-записей изменила загружаемый код"
+    count = lambda text: sum(line.startswith("T") for line in text)
+    size = lambda text: len("\n".join(text))
+    print(f"coalesce: T-записей {count(before)} -> {count(after)}, "
+          f"размер {size(before)} -> {size(after)} байт, "
+          f"загрузка {t_before:.2f}с -> {t_after:.2f}с")
+
+
+def bench_object_file(lines: int = 120_000):
+    import os
+    import tempfile
+
+    parsed, _ = parse_assembly(synthetic_program(lines))
+    records = []
+    deque(first_pass_simple_dict(parsed, OP_TABLE, 2, records=records), maxlen=1)
+    sections = build_sections(records)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "prog.obj")
+        for max_length in (None, T_RECORD_LENGTH):
+            text = write_object_text(sections, max_length)
+            write_object_file(path, read_object_text(text))
+            with ObjectFile(path) as obj:
+                assert write_object_text(obj.sections(), max_length) == text, \
+                    "двоичный файл расходится с текстом"
+
+        t_text, from_text = timed(read_object_text, text)
+
+        def open_binary():
+            with ObjectFile(path) as obj:
+                code = obj.code(0)
+                relocations = len(obj.modifications(0))
+                assert code == from_text[0].code
+                code.release()
+                return relocations
+
+        t_binary, relocations = timed(open_binary)
+        size = os.path.getsize(path)
+    text_size = len("\n".join(text))
+    print(f"object_file: текст {text_size} байт, двоичный {size} байт; "
+          f"разбор текста {t_text:.3f}с, mmap с {relocations} перемещениями {t_binary:.3f}с")
+
+
+def bench_loader(sections: int = 5_000):
+    parsed, _ = parse_assembly(synthetic_modules(sections))
+    records = []
+    *_, (_, _, errors) = first_pass_simple_dict(parsed, OP_TABLE, 0, records=records)
+    assert not errors, errors[:5]
+    text = write_object_text(build_sections(records))
+
+    t_total, result = timed(load_sections, read_object_text(text))
+    assert not result.errors, result.errors[:5]
+    memory = result.memory
+    for i in (0, sections // 2):
+        code = result.estab[f"E{i}"] - result.start
+        target = result.estab[f"E{(i + 1) % sections}"]
+        assert int.from_bytes(memory[code + 1 : code + 4], "big") == target
+    phases = ", ".join(f"{name} {t * 1000:.1f}мс" for name, t in result.timings.items())
+    print(f"loader: {sections} секций, {len(result.estab)} имён в ESTAB, "
+          f"{len(memory)} байт за {t_total * 1000:.1f}мс ({phases})")
+
+
+def bench_relocation(records: int = 300_000):
+    import random
+
+    rng = random.Random(19)
+    size = 4 * records
+    image = bytearray(rng.randbytes(size))
+    # Поля на границах команд, часть записей M попадает в одно поле дважды
+    relocations = [
+        (4 * rng.randrange(records) + 1, rng.choice((0x1000, rng.randrange(1 << 24))))
+        for _ in range(records)
+    ]
+    scalar, vectorized = bytearray(image), bytearray(image)
+    t_scalar, _ = timed(apply_relocations_scalar, scalar, relocations)
+    if numpy is None:
+        print(f"relocation: {records} записей M, скалярно {t_scalar:.2f}с, NumPy не установлен")
+        return
+    t_vector, applied = timed(apply_relocations_vectorized, vectorized, relocations)
+    assert applied and vectorized == scalar, "векторная правка расходится со скалярной"
+    print(f"relocation: {records} записей M, скалярно {t_scalar:.2f}с, "
+          f"NumPy {t_vector:.3f}с, ускорение x{t_scalar / t_vector:.0f}")
+
+
+def resident_memory() -> int | None:
+    """Резидентная память процесса в байтах (только Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except OSError:
+        return None
+
+
+def bench_memory_image(touches: int = 2_000):
+    import random
+    import tempfile
+
+    rng = random.Random(20)
+    before = resident_memory()
+    with MemoryImage() as image:
+        # Разреженные обращения: тронутые страницы, а не весь образ
+        for _ in range(touches):
+            image.write24(rng.randrange(len(image) - 3), 0xABCDEF)
+        after = resident_memory()
+
+        parsed, _ = parse_assembly(synthetic_modules(100))
+        records = []
+        *_, (_, _, errors) = first_pass_simple_dict(parsed, OP_TABLE, 0, records=records)
+        assert not errors, errors[:5]
+        sections = build_sections(records)
+        result = load_sections(sections, 0x100000, image)
+        assert not result.errors, result.errors[:5]
+        loaded = bytes(result.memory)
+        assert loaded.strip(b"\0"), "программа не загружена"
+        assert loaded == bytes(load_sections(sections, 0x100000).memory)
+        result.memory.release()
+
+        n = 200_000
+        t_access, _ = timed(lambda: [image.read24(adr) for adr in range(0, 3 * n, 3)])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "memory.bin")
+            t_dump, _ = timed(image.dump, path)
+            expected = image.read24(0x100000)
+            image.write24(0x100000, 0)
+            t_restore, _ = timed(image.restore, path)
+            assert image.read24(0x100000) == expected
+        size = len(image)
+    rss = "неизвестно" if before is None else f"{(after - before) / 2 ** 20:.1f} МБ"
+    print(f"memory_image: {size >> 20} МБ, {touches} разреженных записей, "
+          f"прирост RSS {rss}; read24 {t_access / n * 1e9:.0f}нс, "
+          f"dump {t_dump * 1000:.1f}мс, restore {t_restore * 1000:.1f}мс")
+
+
+def bench_simulator(iterations: int = 200_000):
+    parsed, _ = parse_assembly(counting_loop_program(iterations))
+    records = []
+    *_, (_, symbols, errors) = first_pass_simple_dict(parsed, SIM_OP_TABLE, 2, records=records)
+    assert not errors, errors
+    sections = build_sections(records)
+    res = symbols.get("P", "RES").addr
+
+    def simulate(simulator):
+        with MemoryImage() as image:
+            loaded = load_sections(sections, 0, image)
+            assert not loaded.errors, loaded.errors
+            loaded.memory.release()
+            cpu = simulator(image, SIM_OP_TABLE)
+            result = cpu.run(loaded.entry or 0)
+            assert result.halted and result.error is None, result.error
+            assert image.read24(res) == iterations
+        return cpu, result
+
+    # Перекрывающиеся команды: запись в общий байт сбрасывает обе
+    with MemoryImage(size=4096) as image:
+        cpu = Simulator(image, SIM_OP_TABLE)
+        cpu.write(0, bytes.fromhex("0C181818"))
+        cpu.decode(0)
+        cpu.decode(1)
+        cpu.write(1, b"\x0C")
+        assert not cpu.cache and not cpu.owners, "устаревшая команда в кэше"
+        assert cpu.decode(0).operand == 0x0C1818
+        cpu.decode(1)
+        cpu.write(0, bytes(8))
+        assert not cpu.cache and not cpu.owners
+
+    cpu, result = simulate(Simulator)
+    print(f"simulator: {result.steps} команд за {result.elapsed:.2f}с, "
+          f"{result.ips / 1e6:.2f} млн команд/с, декодировано {cpu.decodes} раз")
+    blocks, compiled = simulate(BlockSimulator)
+    assert compiled.steps == result.steps
+    # Блоки останавливаются ровно на max_steps
+    with MemoryImage() as image:
+        loaded = load_sections(sections, 0, image)
+        loaded.memory.release()
+        stopped = BlockSimulator(image, SIM_OP_TABLE).run(loaded.entry or 0, max_steps=600)
+        assert not stopped.halted and stopped.steps == 600, stopped
+
+    # Сверка с интерпретатором на случайном коде: шаги, pc, ошибки (запись за
+    # границу образа внутри блока), регистры и память совпадают
+    import random
+
+    def final_state(simulator, code, max_steps, **options):
+        with MemoryImage(size=4096) as image:
+            image.load(0, code)
+            cpu = simulator(image, SIM_OP_TABLE, **options)
+            cpu.registers[1] = 1
+            run = cpu.run(0, max_steps)
+            memory = image.slice(0, 4096).tobytes()
+            return run.pc, run.steps, run.error, cpu.registers, cpu.cc, memory
+
+    rng = random.Random(22)
+    for _ in range(200):
+        code = random_machine_code(rng)
+        max_steps = rng.choice((rng.randrange(1, 80), rng.randrange(80, 3000)))
+        expected = final_state(Simulator, code, max_steps)
+        got = final_state(BlockSimulator, code, max_steps, threshold=rng.choice((1, 2, 16)))
+        assert got == expected, (code.hex(), max_steps, got[:3], expected[:3])
+    print(f"simulator: блоки — {compiled.elapsed:.2f}с, {compiled.ips / 1e6:.2f} млн команд/с, "
+          f"скомпилировано {blocks.compiled} блоков, "
+          f"ускорение x{result.elapsed / compiled.elapsed:.1f}")
+
+
+def bench_profile(iterations: int = 100_000):
+    listing = []
+    records = []
+    lines = iter_parse_assembly(counting_loop_program(iterations))
+    *_, (_, symbols, errors) = first_pass_simple_dict(
+        lines, SIM_OP_TABLE, 2, records=records, listing=listing
+    )
+    assert not errors, errors
+    sections = build_sections(records)
+
+    def simulate(simulator, profiled):
+        with MemoryImage() as image:
+            loaded = load_sections(sections, 0, image)
+            cpu = simulator(image, SIM_OP_TABLE)
+            profile = Profile.for_program(loaded) if profiled else None
+            cpu.set_profile(profile)
+            result = cpu.run(loaded.entry or 0)
+            assert result.halted, result.error
+            loaded.memory.release()
+        return result, profile, loaded
+
+    for simulator in (Simulator, BlockSimulator):
+        plain, _, _ = simulate(simulator, False)
+        result, profile, loaded = simulate(simulator, True)
+        assert profile.total == result.steps, (profile.total, result.steps)
+        print(f"profile: {simulator.__name__} без профиля {plain.elapsed:.2f}с, "
+              f"с профилем {result.elapsed:.2f}с")
+    print("profile: по секциям", profile.section_counts())
+    print("profile: по командам", profile.opcode_counts(SIM_OP_TABLE))
+    for line in hot_spot_report(profile, loaded, listing, symbols, limit=4):
+        print("profile:", line)
+
+
+def bench_batch(jobs: int = 200):
+    import tempfile
+
+    records = []
+    *_, (_, symbols, errors) = first_pass_simple_dict(
+        parse_assembly(counting_loop_program(0))[0], SIM_OP_TABLE, 2, records=records
+    )
+    assert not errors, errors
+    n = symbols.get("P", "N").addr
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "loop.obj")
+        write_object_file(path, build_sections(records))
+        # Одна программа, разные входные данные: число повторений цикла
+        batch = [
+            Job((path,), f"loop{i}", memory=[(n, (1000 + 100 * i).to_bytes(3, "big"))])
+            for i in range(jobs)
+        ]
+        single = run_batch(batch, SIM_OP_TABLE, workers=1)
+        pool = run_batch(batch, SIM_OP_TABLE, workers=max(2, workers))
+        # Ошибочные задания не прерывают пакет
+        broken = run_batch(
+            [Job((path,), "outside", memory=[(0xFFFFFF, b"\0\0")]),
+             Job((os.path.join(tmp, "missing.obj"),), "missing"), batch[0]],
+            SIM_OP_TABLE, workers=2,
+        )
+    assert not single.failed and not pool.failed, single.failed[:1] + pool.failed[:1]
+    assert [r.name for r in broken.failed] == ["outside", "missing"], broken.lines()
+    assert broken.results[2].memory_digest == single.results[0].memory_digest
+    assert [r.memory_digest for r in single.results] == [r.memory_digest for r in pool.results]
+    assert single.results[-1].registers[0] == 1000 + 100 * (jobs - 1)
+    print(f"batch: {jobs} заданий, 1 процесс {single.elapsed:.2f}с, "
+          f"{pool.workers} процессов {pool.elapsed:.2f}с "
+          f"(ядер {workers}), ускорение x{single.elapsed / pool.elapsed:.1f}")
+    print("batch:", pool.lines()[-1])
+
+
+def bench_snapshot(runs: int = 1_000):
+    # Возврат слова данных между командами не сбрасывает кэш команд
+    records = []
+    *_, (_, symbols, errors) = first_pass_simple_dict(
+        parse_assembly("P: START 0\nLOADI 1\nJMP GO\nV: WORD 0\nGO: STORE V\nHALT\nEND")[0],
+        SIM_OP_TABLE, 2, records=records,
+    )
+    assert not errors, errors
+    v = symbols.get("P", "V").addr
+    with MemoryImage(size=4096) as image:
+        load_sections(build_sections(records), 0, image).memory.release()
+        cpu = Simulator(image, SIM_OP_TABLE)
+        assert cpu.run(0).halted and cpu.code_low < v < cpu.code_high
+        cpu.write(v, bytes(3))
+        cached, invalidations = len(cpu.cache), cpu.invalidations
+        snapshot = cpu.snapshot()
+        assert cpu.run(0).halted and image.read24(v) == 1
+        assert cpu.restore(snapshot) == 1 and image.read24(v) == 0
+        assert (len(cpu.cache), cpu.invalidations) == (cached, invalidations), \
+            "возврат данных сбросил команды"
+        # Возвращённый байт кода сбрасывает только свою команду
+        go = symbols.get("P", "GO").addr
+        cpu.store(v, 5)
+        cpu.write(go, bytes([SIM_OP_TABLE["HALT"][0] << 2]))
+        assert cpu.decode(go).mnemonic == "HALT"
+        cached, invalidations = set(cpu.cache), cpu.invalidations
+        cpu.restore(snapshot)
+        assert set(cpu.cache) == cached - {go} and cpu.invalidations == invalidations + 1
+
+    records = []
+    *_, (_, symbols, errors) = first_pass_simple_dict(
+        parse_assembly(counting_loop_program(500))[0], SIM_OP_TABLE, 2, records=records
+    )
+    assert not errors, errors
+    n = symbols.get("P", "N").addr
+    res = symbols.get("P", "RES").addr
+    with MemoryImage() as image:
+        loaded = load_sections(build_sections(records), 0, image)
+        loaded.memory.release()
+        cpu = BlockSimulator(image, SIM_OP_TABLE)
+        # Прогрев: короткий прогон компилирует цикл, снимок — с точки входа
+        cpu.write(n, (100).to_bytes(3, "big"))
+        assert cpu.run(loaded.entry or 0).halted and cpu.compiled
+        cpu.registers[:] = [0] * len(cpu.registers)
+        cpu.pc = loaded.entry or 0
+        snapshot = cpu.snapshot()
+        state = (bytes(image.slice(0, 4096)), list(cpu.registers), cpu.pc)
+
+        restored = 0
+        begin = perf_counter()
+        for i in range(runs):
+            cpu.write(n, (300 + i % 200).to_bytes(3, "big"))
+            result = cpu.run()
+            assert result.halted and image.read24(res) == 300 + i % 200, result
+            restored += cpu.restore(snapshot)
+        t_runs = perf_counter() - begin
+        assert (bytes(image.slice(0, 4096)), cpu.registers, cpu.pc) == state
+        compiled = cpu.compiled
+
+        t_restore, _ = timed(lambda: [cpu.restore() for _ in range(runs)])
+        t_copy, copy = timed(bytes, image.map)
+        t_back, _ = timed(image.load, 0, copy)
+    print(f"snapshot: {runs} прогонов от снимка за {t_runs:.2f}с, "
+          f"{restored / runs:.1f} страниц на возврат, блоков скомпилировано {compiled}; "
+          f"пустой возврат {t_restore / runs * 1e6:.1f}мкс, "
+          f"копия 16 МБ {(t_copy + t_back) * 1000:.1f}мс")
+
+
+BENCHMARKS = {
+    "fast_path": bench_fast_path,
+    "parallel": bench_parallel,
+    "parse_cache": bench_parse_cache,
+    "incremental": bench_incremental,
+    "memory": bench_memory,
+    "dispatch": bench_dispatch,
+    "trace": bench_trace,
+    "forward_refs": bench_forward_refs,
+    "symbols": bench_symbols,
+    "resolution": bench_resolution,
+    "object_code": bench_object_code,
+    "coalesce": bench_coalesce,
+    "object_file": bench_object_file,
+    "loader": bench_loader,
+    "relocation": bench_relocation,
+    "memory_image": bench_memory_image,
+    "simulator": bench_simulator,
+    "profile": bench_profile,
+    "batch": bench_batch,
+    "snapshot": bench_snapshot,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
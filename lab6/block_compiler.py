@@ -0,0 +1,263 @@
+# Второй уровень симулятора: горячие линейные участки кода (базовые блоки)
+# переводятся в одну сгенерированную функцию Python, так что команды блока
+# исполняются без цикла выборки и декодирования.
+from simulator import *
+
+# После скольких входов в адрес с него компилируется блок
+HOT_THRESHOLD = 16
+# Наибольшее число команд в блоке
+MAX_BLOCK = 64
+# Сколько команд блок-цикл исполняет за один вызов (не больше остатка max_steps)
+LOOP_STEPS = 10_000
+
+# Условия переходов; переходом блок заканчивается
+JUMP_CONDITIONS = {
+    "JMP": "True",
+    "JZ": "r[0] == 0",
+    "JEQ": "cpu.cc == 0",
+    "JLT": "cpu.cc < 0",
+    "JGT": "cpu.cc > 0",
+}
+
+# Тексты команд для генерации. В блоке доступны cpu, регистры r, mmap
+# образа m, запись store и limit — сколько команд может исполнить блок-цикл.
+# Подстановки: value — операнд или чтение слова, target — исполнительный
+# адрес, next — адрес следующей команды, count — выражение для числа
+# исполненных команд, done — то же до этой команды, ra/rb — регистры.
+# Блок возвращает (адрес следующей команды или None, число команд).
+_SIGNED_ACC = "a = r[0] - ((r[0] & 0x800000) << 1)"
+BLOCK_TEMPLATES = {
+    "LOAD": "r[0] = {value}",
+    "LOADI": "r[0] = {value}",
+    # Запись может бросить исключение: адрес команды и число исполненных до
+    # неё команд сохраняются для сообщения об ошибке. Запись могла задеть код
+    # этого же блока — тогда выход из блока
+    "STORE": "cpu.pc = {adr}\ncpu.done = {done}\nstore({target}, r[0])\n"
+             "if cpu.dirty:\n    return {next}, {count}",
+    "ADD": "r[0] = (r[0] + {value}) & 0xFFFFFF",
+    "SUB": "r[0] = (r[0] - {value}) & 0xFFFFFF",
+    "COMP": f"{_SIGNED_ACC}\nb = {{value}}\nb -= (b & 0x800000) << 1\ncpu.cc = (a > b) - (a < b)",
+    "NOP": "pass",
+    "HALT": "cpu.pc = {adr}\nreturn None, {count}",
+}
+
+REGISTER_TEMPLATES = {
+    "ADD": "r[{ra}] = (r[{ra}] + r[{rb}]) & 0xFFFFFF",
+    "SUB": "r[{ra}] = (r[{ra}] - r[{rb}]) & 0xFFFFFF",
+    "MOV": "r[{ra}] = r[{rb}]",
+    "COMP": "a = r[{ra}] - ((r[{ra}] & 0x800000) << 1)\n"
+            "b = r[{rb}] - ((r[{rb}] & 0x800000) << 1)\ncpu.cc = (a > b) - (a < b)",
+}
+
+
+def instruction_source(ins: Decoded, count: str, done: str = "0") -> str | None:
+    """Текст команды внутри блока или None, если её нельзя скомпилировать"""
+    if ins.mode == IMMEDIATE and ins.size == 2 and ins.mnemonic in REGISTER_TEMPLATES:
+        template = REGISTER_TEMPLATES[ins.mnemonic]
+    elif (template := BLOCK_TEMPLATES.get(ins.mnemonic)) is None:
+        return None
+    if ins.target is None:
+        if "{target}" in template:
+            # Запись по непосредственному операнду — ошибка, её сообщит интерпретатор
+            return None
+        value = str(ins.operand)
+    else:
+        value = f'int.from_bytes(m[{ins.target}:{ins.target + 3}], "big")'
+    return template.format(
+        value=value, target=ins.target, next=ins.next, count=count, done=done,
+        adr=ins.adr, ra=ins.ra, rb=ins.rb,
+    )
+
+
+def _indent(lines: List[str], level: int) -> str:
+    prefix = "    " * level
+    return "\n".join(prefix + line for text in lines for line in text.split("\n"))
+
+
+@dataclass(slots=True)
+class Block:
+    start: int
+    end: int
+    length: int
+    run: Callable
+    source: str
+    # Блок заканчивается переходом на своё начало и крутится внутри функции
+    loop: bool
+
+
+class BlockSimulator(Simulator):
+    """Симулятор, компилирующий горячие базовые блоки в функции Python.
+    Холодный код исполняется интерпретатором Simulator."""
+
+    def __init__(
+        self,
+        memory: MemoryImage,
+        op_table: Dict[str, Tuple[int, int]],
+        threshold: int = HOT_THRESHOLD,
+    ):
+        super().__init__(memory, op_table)
+        self.threshold = threshold
+        self.blocks: Dict[int, Block] = {}
+        self.counters: Dict[int, int] = {}
+        # Байт кода -> начала блоков, в которые он входит (блоки могут перекрываться)
+        self.block_owners: Dict[int, List[int]] = {}
+        self.block_low = len(memory)
+        self.block_high = 0
+        # Выставляется, если запись сбросила какой-либо блок
+        self.dirty = False
+        # Сколько команд блока исполнено до команды, записанной в pc
+        self.done = 0
+        self.compiled = 0
+
+    def compile_block(self, start: int) -> Block | None:
+        """Блок с адреса start до перехода (включительно) или до команды,
+        которую нельзя скомпилировать. Если переход ведёт на start, цикл
+        исполняется внутри функции по LOOP_STEPS команд за вызов."""
+        decoded = []
+        adr = start
+        jump = None
+        while len(decoded) < MAX_BLOCK and jump is None:
+            try:
+                ins = self.cache.get(adr) or self.decode(adr)
+            except (ValueError, IndexError):
+                # Данные после кода: ошибку сообщит интерпретатор, если дойдёт
+                break
+            if ins.mnemonic in JUMP_CONDITIONS:
+                if ins.target is None:
+                    break
+                jump = ins
+            elif instruction_source(ins, "0") is None:
+                break
+            decoded.append(ins)
+            adr = ins.next
+            if ins.mnemonic == "HALT":
+                break
+        if not decoded:
+            return None
+
+        loop = jump is not None and jump.target == start
+        total = len(decoded)
+        profile = self.profile
+        lines = []
+        for inx, ins in enumerate(decoded, 1):
+            count = f"n + {inx}" if loop else str(inx)
+            done = f"n + {inx - 1}" if loop else str(inx - 1)
+            if profile is not None:
+                lines.append(profile.source(ins.adr, ins.opcode))
+            if ins is not jump:
+                lines.append(instruction_source(ins, count, done))
+            elif loop:
+                lines.append(f"n += {total}")
+                lines.append(f"if not ({JUMP_CONDITIONS[ins.mnemonic]}):\n    return {ins.next}, n")
+                # Следующий проход целиком должен уложиться в limit
+                lines.append(f"if n + {total} > limit:\n    return {start}, n")
+            elif ins.mnemonic == "JMP":
+                lines.append(f"return {ins.target}, {count}")
+            else:
+                condition = JUMP_CONDITIONS[ins.mnemonic]
+                lines.append(f"return ({ins.target} if {condition} else {ins.next}), {count}")
+        if jump is None and decoded[-1].mnemonic != "HALT":
+            lines.append(f"return {adr}, {total}")
+
+        header = f"def block_{start:06X}(cpu, r, m, store, limit):"
+        if loop:
+            source = f"{header}\n    n = 0\n    while True:\n{_indent(lines, 2)}\n"
+        else:
+            source = f"{header}\n{_indent(lines, 1)}\n"
+        namespace = profile.namespace() if profile is not None else {}
+        exec(compile(source, f"<block {start:06X}>", "exec"), namespace)
+        block = Block(start, adr, total, namespace[f"block_{start:06X}"], source, loop)
+
+        self.blocks[start] = block
+        for byte in range(start, adr):
+            self.block_owners.setdefault(byte, []).append(start)
+        self.block_low = min(self.block_low, start)
+        self.block_high = max(self.block_high, adr)
+        self.compiled += 1
+        return block
+
+    def invalidate(self, adr: int, length: int) -> None:
+        super().invalidate(adr, length)
+        if adr >= self.block_high or adr + length <= self.block_low:
+            return
+        owners = self.block_owners
+        for byte in range(max(adr, self.block_low), min(adr + length, self.block_high)):
+            for start in owners.pop(byte, ()):
+                if (block := self.blocks.pop(start, None)) is None:
+                    continue
+                for covered in range(block.start, block.end):
+                    if (starts := owners.get(covered)) is not None and start in starts:
+                        starts.remove(start)
+                # Переписанный код снова должен стать горячим
+                self.counters.pop(start, None)
+                self.dirty = True
+
+    def invalidate_all(self) -> None:
+        super().invalidate_all()
+        self.blocks.clear()
+        self.counters.clear()
+        self.block_owners.clear()
+        self.block_low, self.block_high = len(self.memory), 0
+
+    def run(self, entry: int | None = None, max_steps: int = 10_000_000) -> RunResult:
+        """Как Simulator.run. Блок исполняется, только если целиком укладывается
+        в остаток max_steps, иначе последние команды исполняет интерпретатор —
+        число шагов, pc и ошибки те же, что у Simulator.run"""
+        pc = self.pc if entry is None else entry
+        blocks = self.blocks
+        counters = self.counters
+        cache = self.cache
+        threshold = self.threshold
+        regs = self.registers
+        memory = self.memory.map
+        store = self.store
+        steps = 0
+        halted = False
+        error = None
+        begin = perf_counter()
+        try:
+            while steps < max_steps:
+                block = blocks.get(pc)
+                if block is not None and block.length <= max_steps - steps:
+                    self.dirty = False
+                    limit = min(LOOP_STEPS, max_steps - steps)
+                    try:
+                        next_pc, count = block.run(self, regs, memory, store, limit)
+                    except (ValueError, IndexError):
+                        # Ошибка в записи: блок сохранил её адрес и сколько
+                        # команд исполнено до неё
+                        pc = self.pc
+                        steps += self.done
+                        raise
+                    steps += count
+                    if next_pc is None:
+                        pc = self.pc
+                        halted = True
+                        break
+                    pc = next_pc
+                    continue
+
+                if block is None:
+                    hits = counters[pc] = counters.get(pc, 0) + 1
+                    if hits >= threshold:
+                        if self.compile_block(pc) is not None:
+                            continue
+                        # С этого адреса блок не собрать: больше не пытаться
+                        counters[pc] = -max_steps
+
+                ins = cache.get(pc)
+                if ins is None:
+                    ins = self.decode(pc)
+                next_pc = ins.execute(self, ins)
+                steps += 1
+                if next_pc is None:
+                    halted = True
+                    break
+                pc = next_pc
+        except (ValueError, IndexError) as e:
+            error = f"[{pc:06X}]: {e}"
+        elapsed = perf_counter() - begin
+        self.pc = pc
+        if error is None and not halted:
+            error = f"[{pc:06X}]: Превышено число шагов {max_steps}"
+        return RunResult(pc, steps, elapsed, halted, error)
@@ -0,0 +1,19 @@
+from typing import *
+
+
+class BoundaryIndex:
+    """Границы команд секции: множество для проверки за O(1)"""
+
+    __slots__ = ("addresses",)
+
+    def __init__(self, addresses: Iterable[int] = ()):
+        self.addresses: Set[int] = set(addresses)
+
+    def add(self, addr: int) -> None:
+        self.addresses.add(addr)
+
+    def __contains__(self, addr: int) -> bool:
+        return addr in self.addresses
+
+    def __len__(self) -> int:
+        return len(self.addresses)
@@ -1,4 +1,6 @@
 from lexems import *
+from boundary_index import BoundaryIndex
+from object_code import *
 from pprint import pprint
 
 
@@ -13,69 +15,24 @@ class AddressFormat:
     MOVABLE = 1
 
 
-def address_type(ops: List[Operand]) -> int:
-    if any(isinstance(op, RelativeIdentifier) for op in ops):
+def address_type(signature: Tuple[type, ...]) -> int:
+    if RelativeIdentifier in signature:
         return AddressType.RELATIVE
-    if any(isinstance(op, Identifier) for op in ops):
+    if Identifier in signature:
         return AddressType.DIRECT
     return AddressType.IMMEDIATE
     # return int(any(isinstance(op, Identifier) for op in ops))
 
 
-def display_value(ops: List[Operand], symbol_table, section, expected_size, idr) -> str:
-    try:
-        vals = [op.resolve_value(symbol_table, section, idr) for op in ops]
-        try:
-            if expected_size == 1:
-                return ""
-            strs_pattern = match_op_pattern(ops, XString) or match_op_pattern(
-                ops, CString
-            )
-            if expected_size == 2:
-                if match_op_pattern(ops, Number, Number):
-                    return "".join(f"{val:01x}" for val in vals)
-                if match_op_pattern(ops, Number) or strs_pattern:
-                    return "".join(f"{val:02x}" for val in vals)
-            if expected_size == 3:
-                if match_op_pattern(ops, Number):
-                    return "".join(f"{val:04X}" for val in vals)
-            if expected_size == 4 or strs_pattern:
-                return "".join(f"{val:06X}" for val in vals)
-        except:
-            return "".join(str(val) for val in vals)
-    except KeyError:
-        return ""
-
-
-def byte_display(ops: List[Operand]):
-    if match_op_pattern(ops, Number):
-        val = ops[0].resolve_value()
-        return f"{val:02x}"
-    if match_op_pattern(ops, CString):
-        val = ops[0].data
-        return "".join(f"{ord(c):02x}" for c in val)
-    if match_op_pattern(ops, XString):
-        val = ops[0].data
-        return "0" * ((2 - (len(val) % 2)) % 2) + val
-
-
-def word_display(ops: List[Operand]):
-    if match_op_pattern(ops, Number):
-        val = ops[0].resolve_value()
-        return f"{val:06X}"
-    if match_op_pattern(ops, CString):
-        val = ops[0].data
-        return "".join(f"{ord(c):06X}" for c in val)
-    if match_op_pattern(ops, XString):
-        val = ops[0].data
-        return "0" * ((6 - (len(val) % 6)) % 6) + val
-
-
 @dataclass
 class InterCode:
     def __str__(self):
         pass
 
+    def place(self, sections: List[SectionCode]) -> None:
+        """Перенос записи в образ последней секции"""
+        pass
+
 
 @dataclass
 class TCode(InterCode):
@@ -84,21 +41,31 @@ class TCode(InterCode):
     opcode: int | None
     ops: List[Operand]
 
-    def __str__(self):
-        vals = display_value(self.ops, None, None, self.size, self.size + self.adr)
+    @property
+    def data(self) -> bytes:
+        vals, _ = resolve_operands(self.ops)
         if self.opcode is None:
-            return f"T {self.adr:06X} {self.size:X} {vals}"
-        return f"T {self.adr:06X} {self.size:X} {self.opcode:02X}{vals}"
+            return operand_bytes(self.size, vals) if vals is not None else b""
+        return encode_instruction(self.opcode, self.size, vals)
+
+    def __str__(self):
+        return f"T {self.adr:06X} {self.size:X} {hex_text(self.data)}"
+
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].write(self.adr, self.size, self.data)
 
 
 @dataclass
 class TBinCode(InterCode):
     adr: int
     size: int
-    binary: str
+    data: bytes
 
     def __str__(self):
-        return f"T {self.adr:06X} {self.size:X} {self.binary}"
+        return f"T {self.adr:06X} {self.size:X} {hex_text(self.data)}"
+
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].write(self.adr, self.size, self.data)
 
 
 @dataclass
@@ -113,6 +80,10 @@ class HCode(InterCode):
         else:
             return f"H {self.label} {self.adr:06X} {self.size:X}"
 
+    def place(self, sections: List[SectionCode]) -> None:
+        size = self.size or 0
+        sections.append(SectionCode(self.label, self.adr, size, bytearray(size)))
+
 
 @dataclass
 class ECode(InterCode):
@@ -121,6 +92,9 @@ class ECode(InterCode):
     def __str__(self):
         return f"E {self.adr:06X}"
 
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].entry = self.adr
+
 
 @dataclass
 class MCode(InterCode):
@@ -132,6 +106,9 @@ class MCode(InterCode):
             return f"M {self.adr:06X} {self.name}"
         return f"M {self.adr:06X}"
 
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].modifications.append((self.adr, self.name))
+
 
 class DCode(TCode):
     def __init__(self, name: Identifier):
@@ -139,8 +116,10 @@ class DCode(TCode):
         self.name = name
 
     def __str__(self):
-        vals = display_value(self.ops, None, self.adr, self.size, self.adr + self.size)
-        return f"D {self.name} {vals}"
+        return f"D {self.name} {hex_text(self.data)}"
+
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].definitions.append((str(self.name), int.from_bytes(self.data, "big")))
 
 
 @dataclass
@@ -150,423 +129,588 @@ class RCode(InterCode):
     def __str__(self):
         return f"R {self.name}"
 
+    def place(self, sections: List[SectionCode]) -> None:
+        sections[-1].references.append(self.name)
+
+
+def build_sections(records: Iterable[InterCode]) -> List[SectionCode]:
+    """Образы секций по записям первого прохода, текст при этом не строится"""
+    sections: List[SectionCode] = []
+    for record in records:
+        record.place(sections)
+    return sections
+
+
+def validate_address_range(addr: int, context: str = "") -> str | None:
+    if not (0x000000 <= addr <= 0xFFFFFF):
+        return f"Адрес {hex(addr)} вне диапазона 000000-FFFFFF ({context})"
+
+
+# Допустимые сигнатуры операндов для команд каждого размера
+INSTRUCTION_SIGNATURES = {
+    1: frozenset({()}),
+    2: frozenset({(Number,), (Register, Register), (CString,), (XString,)}),
+    3: frozenset({(RelativeIdentifier,)}),
+    4: frozenset({(Identifier,), (Number,), (CString,), (XString,)}),
+}
 
-def first_pass_simple_dict(
-    parsed_lines: List[ParsedLine],
-    op_table_dict: Dict[str, Tuple[int, int]],
-    adr_method: int,
-):
-    # Теперь symbol_table: section -> name -> type{adr: int, type: str}
 
-    current_section = ""
-    section_existence = set()
+def _check_byte_immediate(mnemonic: str, operands: List[Operand]) -> str | None:
+    op_value = operands[0].resolve_value()
+    if not (0x00 <= op_value <= 0xFF):
+        return f"Непосредственное значение {op_value} не влезает в 1 байт"
 
-    section_symbols: Dict[str, Dict[str, Any]] = {}
-    # Все равно промежуточная табличка, стоит ли разбивать ее на секции?
-    symbol_table_blank_lines = {}
 
-    def validate_symbol_table() -> None:
-        for name in symbol_table_blank_lines:
-            errors.append(f"Есть ссылка на несуществующее символическое имя {name}")
+def _check_byte_string(mnemonic: str, operands: List[Operand]) -> str | None:
+    if operands[0].size() > 1:
+        return f"Строковая константа c'{operands[0].resolve_value()}' не влезает в 1 байт"
 
-    auxiliary_table = []
-    errors = []
 
-    def result():
+def _check_address_operand(mnemonic: str, operands: List[Operand]) -> str | None:
+    return validate_address_range(operands[0].resolve_value(), f"Операнд {mnemonic}")
+
+
+# Проверки значений операндов по (размеру команды, сигнатуре)
+OPERAND_CHECKS = {
+    (2, (Number,)): _check_byte_immediate,
+    (2, (CString,)): _check_byte_string,
+    (2, (XString,)): _check_byte_string,
+    (4, (Number,)): _check_address_operand,
+    (4, (CString,)): _check_address_operand,
+    (4, (XString,)): _check_address_operand,
+}
+
+
+def validate_operands_basic(
+    mnemonic: str, operands: List[Operand], op_size: int, signature: Tuple[type, ...]
+) -> str | None:
+    allowed = INSTRUCTION_SIGNATURES.get(op_size)
+    if allowed is not None and signature not in allowed:
+        return f"Некорректный формат команды {mnemonic} в {op_size} байт"
+    if check := OPERAND_CHECKS.get((op_size, signature)):
+        return check(mnemonic, operands)
+
+
+@dataclass(slots=True)
+class Fixup:
+    """Место в записи, куда подставится адрес ещё не определённого имени"""
+
+    inx: int
+    slot: int
+    kind: int
+
+
+# Вид адресации ссылки по типу операнда
+FIXUP_KINDS = {
+    Identifier: AddressType.DIRECT,
+    RelativeIdentifier: AddressType.RELATIVE,
+}
+
+
+@dataclass(slots=True)
+class TraceStep:
+    """Изменения за один шаг трассировки первого прохода"""
+
+    # Тексты новых записей вспомогательной таблицы, по порядку
+    records: List[str]
+    # (индекс, новый текст) ранее выданных записей, изменённых после выдачи
+    patched: List[Tuple[int, str]]
+    # Новые или изменённые символические имена
+    symbols: List[Symbol]
+    errors: List[str]
+
+
+@dataclass(slots=True)
+class ListingLine:
+    """Строка исходника, занявшая память: секция и адрес её кода"""
+
+    section: str
+    adr: int
+    line: ParsedLine
+    # Номер строки, если разбор шёл через iter_parse_assembly
+    number: int | None = None
+
+
+class FirstPassState:
+    """Состояние однопроходного ассемблера, общее для обработчиков директив"""
+
+    def __init__(
+        self,
+        op_table_dict: Dict[str, Tuple[int, int]],
+        adr_method: int,
+        trace: bool = False,
+        records: List[InterCode] | None = None,
+    ):
+        self.op_table_dict = op_table_dict
+        self.adr_method = adr_method
+
+        self.current_section = ""
+        self.section_existence = set()
+        self.symbol_table = SymbolTable()
+        # Имена текущей секции: разрешение операндов ищет прямо в нём
+        self.section_symbols: Dict[str, Symbol] = {}
+        # Цепочки исправлений: имя -> места ссылок на него вперёд
+        # Все равно промежуточная табличка, стоит ли разбивать ее на секции?
+        self.fixups: Dict[str, List[Fixup]] = {}
+
+        # Записи можно получить снаружи, например для build_sections
+        self.auxiliary_table: List[InterCode] = records if records is not None else []
+        self.errors = []
+
+        self.location_counter = 0
+        # Границы команд текущей секции для проверки точки входа
+        self.address_space = BoundaryIndex([0])
+        self.start_addr = 0
+        self.start_found = False
+        self.end_found = False
+        self.start_inx = 0
+
+        self.modification_table: List[Tuple[int, str]] = []
+
+        # Что уже выдано трассировкой и что изменилось с прошлого шага
+        self.trace = trace
+        self.traced_records = 0
+        self.traced_errors = 0
+        self.patched_records: Set[int] = set()
+        self.changed_symbols: Dict[Tuple[str, str], None] = {}
+
+    def line_error(self, msg) -> None:
+        self.errors.append(f"[{self.current_section}:{self.location_counter:06X}]: {msg}")
+
+    def result(self):
         # result_table = [process_intercode(code, symbol_table, op_table_dict) for code in auxiliary_table]
-        result_table = [str(line) for line in auxiliary_table]
+        result_table = [str(line) for line in self.auxiliary_table]
         return (
-            (None, section_symbols, errors)
-            if errors
-            else (result_table, section_symbols, [])
+            (None, self.symbol_table, self.errors)
+            if self.errors
+            else (result_table, self.symbol_table, [])
         )
 
-    location_counter = 0
-    address_space = [0]
-    start_addr = 0
-    start_found = False
-    end_found = False
-
-    modification_table: List[Tuple[int, str]] = []
-
-    def print_modification_table():
-        nonlocal modification_table
-        for location, name in modification_table:
-            symbol = section_symbols[current_section][name]
-            if symbol["type"] == "EXTREF":
-                auxiliary_table.append(MCode(location, name))
-            else:
-                auxiliary_table.append(MCode(location, None))
-        modification_table = []
-
-    start_inx = len(auxiliary_table)
-
-    def validate_address_range(addr: int, context: str = "") -> str | None:
-        if not (0x000000 <= addr <= 0xFFFFFF):
-            return f"Адрес {hex(addr)} вне диапазона 000000-FFFFFF ({context})"
-
-    def validate_operands_basic(
-        mnemonic: str, operands: List[Operand], op_size: int
-    ) -> str | None:
-        not_correct_format = f"Некорректный формат команды {mnemonic} в {op_size} байт"
-        if op_size == 1 and not match_op_pattern(operands):
-            return not_correct_format
-        strs_matches = match_op_pattern(operands, CString) or match_op_pattern(
-            operands, XString
+    def touch_record(self, inx: int) -> None:
+        if self.trace:
+            self.patched_records.add(inx)
+
+    def touch_symbol(self, name: str) -> None:
+        if self.trace:
+            self.changed_symbols[(self.current_section, name)] = None
+
+    def trace_step(self) -> TraceStep:
+        aux = self.auxiliary_table
+        step = TraceStep(
+            records=[str(code) for code in aux[self.traced_records :]],
+            patched=[
+                (inx, str(aux[inx]))
+                for inx in sorted(self.patched_records)
+                if inx < self.traced_records
+            ],
+            symbols=[
+                self.symbol_table.get(section, name)
+                for section, name in self.changed_symbols
+            ],
+            errors=self.errors[self.traced_errors :],
+        )
+        self.traced_records = len(aux)
+        self.traced_errors = len(self.errors)
+        self.patched_records.clear()
+        self.changed_symbols.clear()
+        return step
+
+    @property
+    def symbols(self) -> Dict[str, Symbol]:
+        return self.section_symbols
+
+    def validate_symbol_table(self) -> None:
+        names = dict.fromkeys(
+            symbol.name for symbol in self.symbol_table.undefined(self.current_section)
         )
-        if op_size == 2:
-            if not (
-                match_op_pattern(operands, Number)
-                or match_op_pattern(operands, Register, Register)
-                or strs_matches
-            ):
-                return not_correct_format
-            if match_op_pattern(operands, Number):
-                op_value = operands[0].resolve_value()
-                if not (0x00 <= op_value <= 0xFF):
-                    return f"Непосредственное значение {op_value} не влезает в 1 байт"
-            if strs_matches:
-                if operands[0].size() > 1:
-                    return f"Строковая константа c'{operands[0].resolve_value()}' не влезает в 1 байт"
-        if op_size == 3:
-            if not match_op_pattern(operands, RelativeIdentifier):
-                return not_correct_format
-        if op_size == 4:
-            if not (
-                match_op_pattern(operands, Identifier)
-                or match_op_pattern(operands, Number)
-                or strs_matches
-            ):
-                return not_correct_format
-            if match_op_pattern(operands, Number) or strs_matches:
-                op_value = operands[0].resolve_value()
-                if valid_err := validate_address_range(op_value, f"Операнд {mnemonic}"):
-                    return valid_err
-
-    def check_adr_method(ops):
-        if adr_method == 0 and any(isinstance(op, RelativeIdentifier) for op in ops):
+        # EXTREF после ссылки заменяет запись имени, но цепочка исправлений
+        # остаётся незакрытой — это тоже ссылка на неопределённое имя
+        names.update(dict.fromkeys(self.fixups))
+        for name in names:
+            self.errors.append(f"Есть ссылка на несуществующее символическое имя {name}")
+        # Ссылки секции не должны разрешаться метками следующих секций
+        self.fixups.clear()
+
+    def print_modification_table(self) -> None:
+        for location, name in self.modification_table:
+            if self.symbols[name].type is SymbolType.EXTREF:
+                self.auxiliary_table.append(MCode(location, name))
+            else:
+                self.auxiliary_table.append(MCode(location, None))
+        self.modification_table = []
+
+    def check_adr_method(self, signature):
+        if self.adr_method == 0 and RelativeIdentifier in signature:
             return "Встретился операнд с относительной адресацией"
-        if adr_method == 1 and any(isinstance(op, Identifier) for op in ops):
+        if self.adr_method == 1 and Identifier in signature:
             return "Встретился операнд с прямой адресацией"
 
-    def set_location_counter(new_adr):
-        nonlocal location_counter
-        location_counter = new_adr
-        address_space.append(new_adr)
+    def set_location_counter(self, new_adr):
+        self.location_counter = new_adr
+        self.address_space.add(new_adr)
 
-    def resolve_or_id(op: Operand, symbol_table, section, idr):
-        try:
-            return Number(op.resolve_value(symbol_table, section, idr))
-        except ValueError as err:
-            raise err
-        except:
-            return op
-
-    def resolve_t_record(trecord: TCode, section=""):
+    def resolve_t_record(self, inx: int) -> None:
+        """Подставляет значения операндов записи, на неизвестные имена заводит исправления"""
+        trecord = self.auxiliary_table[inx]
+        ops = trecord.ops
         idr = trecord.adr + trecord.size
-        trecord.ops = [
-            resolve_or_id(op, section_symbols, section, idr) for op in trecord.ops
-        ]
-        return trecord
+        for slot, op in enumerate(ops):
+            res = op.try_resolve(self.section_symbols, idr)
+            if type(res) is not Resolution:
+                ops[slot] = make_number(res)
+            elif res.kind == ResolutionKind.PENDING:
+                if op.data not in self.section_symbols:
+                    self.symbol_table.add(Symbol(op.data, self.current_section))
+                    self.touch_symbol(op.data)
+                fixup = Fixup(inx, slot, FIXUP_KINDS[type(op)])
+                self.fixups.setdefault(op.data, []).append(fixup)
+            else:
+                self.line_error(res.error)
+
+    def apply_fixup(self, fixup: Fixup, symbol: Symbol) -> None:
+        trecord = self.auxiliary_table[fixup.inx]
+        if symbol.type is SymbolType.EXTREF:
+            if fixup.kind == AddressType.RELATIVE:
+                self.line_error("Внешняя ссылка в относительной адресации")
+                return
+            value = 0
+        elif fixup.kind == AddressType.RELATIVE:
+            value = relative_offset(symbol.addr, trecord.adr + trecord.size)
+        else:
+            value = symbol.addr
+        trecord.ops[fixup.slot] = make_number(value)
+
+    def define_label(self, label: str) -> None:
+        symbol = self.section_symbols.get(label)
+        if symbol is not None and symbol.addr is not None:
+            self.line_error(f"Дублирующаяся метка '{label}'")
+            return
+        if addr_err := validate_address_range(
+            self.location_counter, f" для метки '{label}'"
+        ):
+            self.line_error(addr_err)
+        if symbol is None:
+            symbol = self.symbol_table.add(Symbol(label, self.current_section))
+        symbol.addr = self.location_counter
+        self.touch_symbol(label)
+        # Патчим только места ссылок на эту метку, остальные операнды не трогаем
+        for fixup in self.fixups.pop(label, ()):
+            self.apply_fixup(fixup, symbol)
+            self.touch_record(fixup.inx)
+
+    def close_section_size(self) -> None:
+        prog_size = self.location_counter - self.start_addr
+        self.auxiliary_table[self.start_inx].size = prog_size
+        self.touch_record(self.start_inx)
+
+    def entry_point(self, line: ParsedLine) -> int:
+        addr = self.start_addr
+        if line.command.signature == (Number,):
+            addr = line.command.operands[0].resolve_value()
+        if addr not in self.address_space:
+            self.line_error("Некорректный адрес точки входа")
+        return addr
+
+    def open_section(self, name: str) -> None:
+        self.current_section = name
+        self.section_existence.add(name)
+        self.start_inx = len(self.auxiliary_table)
+        self.auxiliary_table.append(HCode(name, self.location_counter, None))
+        self.section_symbols = self.symbol_table.open_section(name)
 
-    for line_num, line in enumerate(parsed_lines, 1):
-        if end_found:
-            # lineErr("Команда после END")
-            break
-        mnemonic = line.command.mnemonic
-        ops = line.command.operands
-        lineErr = lambda msg: errors.append(
-            f"[{current_section}:{location_counter:06X}]: {msg}"
-        )
 
-        if mnemonic == "START":
-            if start_found:
-                lineErr("Повторная директива START")
-            start_found = True
-
-            if not (match_op_pattern(ops) or match_op_pattern(ops, Number)):
-                lineErr("Неккоректный адрес в START")
-
-            if match_op_pattern(ops, Number):
-                location_counter = ops[0].resolve_value()
-                address_space = [location_counter]
-                start_addr = location_counter
-
-            if addr_err := validate_address_range(location_counter, "адрес загрузки"):
-                lineErr(addr_err)
-            if location_counter != 0:
-                lineErr("Не нулевой адрес загрузки в относительном формате")
-            if not line.label:
-                lineErr("Отстуствует метка у директивы START")
-            current_section = line.label
-            section_existence.add(current_section)
-            # auxiliary_table.append(f"H {line.label} {location_counter:06x} ")
-            start_inx = len(auxiliary_table)
-            auxiliary_table.append(HCode(line.label, location_counter, None))
-            section_symbols[current_section] = dict()
-            continue
-
-        if not start_found:
-            lineErr("Программа не начинается с директивы START")
-            # continue
-
-        if mnemonic == "CSECT":
-            if not (match_op_pattern(ops) or match_op_pattern(ops, Number)):
-                lineErr("Некорректный формат директивы CSECT")
-            if not line.label:
-                lineErr("Отсутствует метка у директивы CSECT")
-            print_modification_table()
-            validate_symbol_table()
-
-            prog_size = location_counter - start_addr
-            auxiliary_table[start_inx].size = prog_size
-            addr = start_addr
-            if match_op_pattern(ops, Number):
-                addr = ops[0].resolve_value()
-            if addr not in address_space:
-                lineErr("Некорректный адрес точки входа")
-            auxiliary_table.append(ECode(addr))
-
-            current_section = line.label
-            if current_section in section_existence:
-                lineErr(f'Повторная секция "{current_section}" не допустима')
-            section_existence.add(current_section)
-
-            start_inx = len(auxiliary_table)
-            location_counter = 0
-            start_addr = location_counter
-            address_space = [start_addr]
-            auxiliary_table.append(HCode(current_section, location_counter, None))
-            section_symbols[current_section] = dict()
-            continue
+@dataclass
+class Directive:
+    handle: Callable[[FirstPassState, ParsedLine], None]
+    # Проверять, что программа уже начата директивой START
+    needs_start: bool = True
+    # Метка строки определяет символическое имя (у START/CSECT это имя секции)
+    binds_label: bool = True
+    # После строки генератор отдаёт промежуточный результат
+    emits_step: bool = True
 
-        # Обработка меток
-        if line.label:
-            if (
-                line.label in section_symbols[current_section]
-                and section_symbols[current_section][line.label]["addr"] is not None
-            ):
-                lineErr(f"Дублирующаяся метка '{line.label}'")
-            else:
-                if addr_err := validate_address_range(
-                    location_counter, f" для метки '{line.label}'"
-                ):
-                    lineErr(addr_err)
-                if line.label not in section_symbols[current_section]:
-                    section_symbols[current_section][line.label] = {
-                        "type": None,
-                        "addr": None,
-                    }
-                section_symbols[current_section][line.label]["addr"] = location_counter
-                if line.label in symbol_table_blank_lines:
-                    for inx in symbol_table_blank_lines[line.label]:
-                        trecord: TCode = auxiliary_table[inx]
-                        try:
-                            trecord = resolve_t_record(trecord, current_section)
-                        except Exception as err:
-                            lineErr(err)
-                    symbol_table_blank_lines.pop(line.label)
-
-        if mnemonic == "END":
-            if not (match_op_pattern(ops) or match_op_pattern(ops, Number)):
-                lineErr("Неккоректный формат директивы END")
-            end_found = True
-            prog_size = location_counter - start_addr
-            # auxiliary_table = [i + f"{prog_size:x}" if i.startswith("H") else i for i in auxiliary_table]
-            auxiliary_table[start_inx].size = prog_size
-            addr = start_addr
-            if match_op_pattern(ops, Number):
-                addr = ops[0].resolve_value()
-            if addr not in address_space:
-                lineErr("Некорректный адрес точки входа")
-
-            # Формирование модификаторов
-            print_modification_table()
-            validate_symbol_table()
-            # for location in modification_table:
-            #     # auxiliary_table.append(f"M {location:06X}")
-            #     auxiliary_table.append(MCode(location))
-
-            # auxiliary_table.append(f"E {addr:06x}")
-            auxiliary_table.append(ECode(addr))
-            # auxiliary_table.append((location_counter, line))
-            continue
-
-        # auxiliary_table.append((location_counter, line))
-
-        # Обработка директив и команд
-        if mnemonic == "WORD":
-            if (
-                match_op_pattern(ops, Number)
-                or match_op_pattern(ops, CString)
-                or match_op_pattern(ops, XString)
-            ):
-                if match_op_pattern(ops, Number):
-                    value = ops[0].resolve_value()
-                    if not (0 <= value <= 0xFFFFFF):
-                        lineErr(f"Значение {value} выходит за пределы 3-байтного слова")
-                size = 3 * ops[0].size()
-                # auxiliary_table.append(f"T {location_counter:06X} {size:X} {word_display(ops)}")
-                auxiliary_table.append(
-                    TBinCode(location_counter, size, word_display(ops))
-                )
-                set_location_counter(location_counter + size)
-            else:
-                lineErr("Некорректный операнд директивы WORD")
-
-        elif mnemonic == "RESW":
-            if match_op_pattern(ops, Number):
-                words = ops[0].resolve_value()
-                if words < 0:
-                    lineErr("Отрицательное количество слов в RESW")
-                size = 3 * words
-                new_address = location_counter + size
-                if addr_err := validate_address_range(new_address, "после RESW"):
-                    lineErr(addr_err)
-                auxiliary_table.append(TBinCode(location_counter, size, ""))
-                set_location_counter(new_address)
-            else:
-                lineErr("Некорректный формат директивы RESW")
-
-        elif mnemonic == "BYTE":
-            if (
-                match_op_pattern(ops, Number)
-                or match_op_pattern(ops, CString)
-                or match_op_pattern(ops, XString)
-            ):
-                size = ops[0].size()
-                if match_op_pattern(ops, Number):
-                    value = ops[0].resolve_value()
-                    if not (0 <= value <= 0xFF):
-                        lineErr(f"Значение {value} выходит за пределы 1 Байта")
-                # auxiliary_table.append(f"T {location_counter:06X} {size:X} {byte_display(ops)}")
-                auxiliary_table.append(
-                    TBinCode(location_counter, size, byte_display(ops))
-                )
-                set_location_counter(location_counter + size)
-            else:
-                lineErr("Некорректный операнд директивы BYTE")
-
-        elif mnemonic == "RESB":
-            if match_op_pattern(ops, Number):
-                bytes = ops[0].resolve_value()
-                if bytes < 0:
-                    lineErr("Отрицательное количество слов в RESB")
-                size = bytes
-                new_address = location_counter + size
-                if addr_err := validate_address_range(new_address, "после RESB"):
-                    lineErr(addr_err)
-                # auxiliary_table.append(f"T {location_counter:06X} {size:X}")
-                auxiliary_table.append(TBinCode(location_counter, size, ""))
-                set_location_counter(new_address)
-            else:
-                lineErr("Некорректный формат директивы RESB")
 
-        elif mnemonic == "EXTDEF":
-            if not match_op_pattern(ops, Identifier) or line.label:
-                lineErr("Некорректный формат EXTDEF")
-            else:
-                for op in ops:
-                    if op.data in section_symbols[current_section]:
-                        record = section_symbols[current_section][op.data]
-                        if record["type"] is None:
-                            record["type"] = "EXTDEF"
-                        else:
-                            lineErr("Переопределение на EXTDEF")
-                    else:
-                        section_symbols[current_section][op.data] = {
-                            "type": "EXTDEF",
-                            "addr": None,
-                        }
-                    auxiliary_table.append(DCode(op))
-                    symbol_table_blank_lines.setdefault(op.data, []).append(
-                        len(auxiliary_table) - 1
-                    )
-
-        elif mnemonic == "EXTREF":
-            if not match_op_pattern(ops, Identifier) or line.label:
-                lineErr("Некорректный формат EXTREF")
-            else:
-                for op in ops:
-                    if (
-                        op.data in section_symbols[current_section]
-                        and section_symbols[current_section][op.data]["type"]
-                        is not None
-                    ):
-                        lineErr(f"Некорректный extref")
-                    section_symbols[current_section][op.data] = {
-                        "addr": None,
-                        "type": "EXTREF",
-                    }
-                    auxiliary_table.append(RCode(op.data))
-
-        elif mnemonic in op_table_dict:
-            opcode, op_size = op_table_dict[mnemonic]
-
-            # Проверка операндов команды
-            if operands_err := validate_operands_basic(
-                mnemonic, line.command.operands, op_size
-            ):
-                lineErr(operands_err)
-
-            new_address = location_counter + op_size
-            if addr_err := validate_address_range(
-                new_address, f" после команды {mnemonic}"
-            ):
-                lineErr(addr_err)
-
-            addrtype = address_type(ops)
-            op_addr_code = (opcode << 2) | addrtype
-            disp = display_value(ops, section_symbols, "", op_size, new_address)
-            # auxiliary_table.append(f"T {location_counter:06X} {op_size} {op_addr_code:02X}{disp}")
-            trecord = TCode(location_counter, op_size, op_addr_code, ops)
-            try:
-                trecord = resolve_t_record(trecord, current_section)
-            except Exception as err:
-                lineErr(err)
-            auxiliary_table.append(trecord)
-
-            if address_type(ops) == AddressType.DIRECT:
-                for op in ops:
-                    modification_table.append((location_counter, str(op)))
-
-            set_location_counter(new_address)
-
-            if err := check_adr_method(ops):
-                lineErr(err)
-
-            for i in ops:
-                if (
-                    isinstance(i, Identifier) or isinstance(i, RelativeIdentifier)
-                ) and i.data not in section_symbols[current_section]:
-                    section_symbols[current_section][i.data] = {
-                        "addr": None,
-                        "type": None,
-                    }
-                    symbol_table_blank_lines.setdefault(i.data, []).append(
-                        len(auxiliary_table) - 1
-                    )
+# Обработчики директив по мнемонике, директивы имеют приоритет над командами
+DIRECTIVES: Dict[str, Directive] = {}
+
 
+def register_directive(
+    mnemonic: str, needs_start: bool = True, binds_label: bool = True, emits_step: bool = True
+):
+    """Декоратор для добавления директивы: handle(state, line)"""
+
+    def register(handle):
+        DIRECTIVES[mnemonic] = Directive(handle, needs_start, binds_label, emits_step)
+        return handle
+
+    return register
+
+
+@register_directive("START", needs_start=False, binds_label=False, emits_step=False)
+def start_directive(state: FirstPassState, line: ParsedLine) -> None:
+    ops = line.command.operands
+    signature = line.command.signature
+    if state.start_found:
+        state.line_error("Повторная директива START")
+    state.start_found = True
+
+    if signature not in ADDRESS_SIGNATURES:
+        state.line_error("Неккоректный адрес в START")
+
+    if signature == (Number,):
+        state.location_counter = ops[0].resolve_value()
+        state.address_space = BoundaryIndex([state.location_counter])
+        state.start_addr = state.location_counter
+
+    if addr_err := validate_address_range(state.location_counter, "адрес загрузки"):
+        state.line_error(addr_err)
+    if state.location_counter != 0:
+        state.line_error("Не нулевой адрес загрузки в относительном формате")
+    if not line.label:
+        state.line_error("Отстуствует метка у директивы START")
+    # auxiliary_table.append(f"H {line.label} {location_counter:06x} ")
+    state.open_section(line.label)
+
+
+@register_directive("CSECT", binds_label=False, emits_step=False)
+def csect_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature not in ADDRESS_SIGNATURES:
+        state.line_error("Некорректный формат директивы CSECT")
+    if not line.label:
+        state.line_error("Отсутствует метка у директивы CSECT")
+    state.print_modification_table()
+    state.validate_symbol_table()
+
+    state.close_section_size()
+    state.auxiliary_table.append(ECode(state.entry_point(line)))
+
+    if line.label in state.section_existence:
+        state.current_section = line.label
+        state.line_error(f'Повторная секция "{line.label}" не допустима')
+
+    state.location_counter = 0
+    state.start_addr = state.location_counter
+    state.address_space = BoundaryIndex([state.start_addr])
+    state.open_section(line.label)
+
+
+@register_directive("END", emits_step=False)
+def end_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature not in ADDRESS_SIGNATURES:
+        state.line_error("Неккоректный формат директивы END")
+    state.end_found = True
+    # auxiliary_table = [i + f"{prog_size:x}" if i.startswith("H") else i for i in auxiliary_table]
+    state.close_section_size()
+    addr = state.entry_point(line)
+
+    # Формирование модификаторов
+    state.print_modification_table()
+    state.validate_symbol_table()
+
+    # auxiliary_table.append(f"E {addr:06x}")
+    state.auxiliary_table.append(ECode(addr))
+
+
+@register_directive("WORD")
+def word_directive(state: FirstPassState, line: ParsedLine) -> None:
+    ops = line.command.operands
+    signature = line.command.signature
+    if signature not in DATA_SIGNATURES:
+        state.line_error("Некорректный операнд директивы WORD")
+        return
+    if signature == (Number,):
+        value = ops[0].resolve_value()
+        if not (0 <= value <= 0xFFFFFF):
+            state.line_error(f"Значение {value} выходит за пределы 3-байтного слова")
+    size = 3 * ops[0].size()
+    # auxiliary_table.append(f"T {location_counter:06X} {size:X} {word_display(ops)}")
+    state.auxiliary_table.append(
+        TBinCode(state.location_counter, size, word_data(ops))
+    )
+    state.set_location_counter(state.location_counter + size)
+
+
+@register_directive("BYTE")
+def byte_directive(state: FirstPassState, line: ParsedLine) -> None:
+    ops = line.command.operands
+    signature = line.command.signature
+    if signature not in DATA_SIGNATURES:
+        state.line_error("Некорректный операнд директивы BYTE")
+        return
+    size = ops[0].size()
+    if signature == (Number,):
+        value = ops[0].resolve_value()
+        if not (0 <= value <= 0xFF):
+            state.line_error(f"Значение {value} выходит за пределы 1 Байта")
+    # auxiliary_table.append(f"T {location_counter:06X} {size:X} {byte_display(ops)}")
+    state.auxiliary_table.append(
+        TBinCode(state.location_counter, size, byte_data(ops))
+    )
+    state.set_location_counter(state.location_counter + size)
+
+
+def reserve(state: FirstPassState, size: int, directive: str) -> None:
+    new_address = state.location_counter + size
+    if addr_err := validate_address_range(new_address, f"после {directive}"):
+        state.line_error(addr_err)
+    # auxiliary_table.append(f"T {location_counter:06X} {size:X}")
+    state.auxiliary_table.append(TBinCode(state.location_counter, size, b""))
+    state.set_location_counter(new_address)
+
+
+@register_directive("RESW")
+def resw_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature != (Number,):
+        state.line_error("Некорректный формат директивы RESW")
+        return
+    words = line.command.operands[0].resolve_value()
+    if words < 0:
+        state.line_error("Отрицательное количество слов в RESW")
+    reserve(state, 3 * words, "RESW")
+
+
+@register_directive("RESB")
+def resb_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature != (Number,):
+        state.line_error("Некорректный формат директивы RESB")
+        return
+    size = line.command.operands[0].resolve_value()
+    if size < 0:
+        state.line_error("Отрицательное количество слов в RESB")
+    reserve(state, size, "RESB")
+
+
+@register_directive("EXTDEF")
+def extdef_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature != (Identifier,) or line.label:
+        state.line_error("Некорректный формат EXTDEF")
+        return
+    symbols = state.symbols
+    for op in line.command.operands:
+        symbol = symbols.get(op.data)
+        if symbol is None:
+            state.symbol_table.add(Symbol(op.data, state.current_section, SymbolType.EXTDEF))
+        elif symbol.type is SymbolType.LOCAL:
+            state.symbol_table.export(symbol)
         else:
-            lineErr(f"Неизвестная команда '{mnemonic}'")
+            state.line_error("Переопределение на EXTDEF")
+        state.touch_symbol(op.data)
+        state.auxiliary_table.append(DCode(op))
+        state.resolve_t_record(len(state.auxiliary_table) - 1)
+
+
+@register_directive("EXTREF")
+def extref_directive(state: FirstPassState, line: ParsedLine) -> None:
+    if line.command.signature != (Identifier,) or line.label:
+        state.line_error("Некорректный формат EXTREF")
+        return
+    symbols = state.symbols
+    for op in line.command.operands:
+        if op.data in symbols and symbols[op.data].type is not SymbolType.LOCAL:
+            state.line_error(f"Некорректный extref")
+        state.symbol_table.add(Symbol(op.data, state.current_section, SymbolType.EXTREF))
+        state.touch_symbol(op.data)
+        state.auxiliary_table.append(RCode(op.data))
+
+
+def instruction(state: FirstPassState, line: ParsedLine) -> None:
+    mnemonic = line.command.mnemonic
+    ops = line.command.operands
+    signature = line.command.signature
+    opcode, op_size = state.op_table_dict[mnemonic]
+    location_counter = state.location_counter
+
+    # Проверка операндов команды
+    if operands_err := validate_operands_basic(mnemonic, ops, op_size, signature):
+        state.line_error(operands_err)
 
-        yield result()
+    new_address = location_counter + op_size
+    if addr_err := validate_address_range(new_address, f" после команды {mnemonic}"):
+        state.line_error(addr_err)
+
+    addrtype = address_type(signature)
+    op_addr_code = (opcode << 2) | addrtype
+    # auxiliary_table.append(f"T {location_counter:06X} {op_size} {op_addr_code:02X}{disp}")
+    # Свой список операндов: исправления пишут в него, разобранная строка не меняется
+    state.auxiliary_table.append(TCode(location_counter, op_size, op_addr_code, list(ops)))
+    state.resolve_t_record(len(state.auxiliary_table) - 1)
+
+    if addrtype == AddressType.DIRECT:
+        for op in ops:
+            state.modification_table.append((location_counter, str(op)))
+
+    state.set_location_counter(new_address)
+
+    if err := state.check_adr_method(signature):
+        state.line_error(err)
+
+
+def unknown_command(state: FirstPassState, line: ParsedLine) -> None:
+    state.line_error(f"Неизвестная команда '{line.command.mnemonic}'")
+
+
+INSTRUCTION = Directive(instruction)
+UNKNOWN_COMMAND = Directive(unknown_command)
+
+
+def first_pass_simple_dict(
+    parsed_lines: Iterable[ParsedLine | Tuple[int, ParsedLine | str]],
+    op_table_dict: Dict[str, Tuple[int, int]],
+    adr_method: int,
+    trace: bool = False,
+    records: List[InterCode] | None = None,
+    listing: List[ListingLine] | None = None,
+):
+    """Однопроходная сборка.
+
+    Без трассировки генератор выдаёт один итог (таблица, символы, ошибки).
+    С trace=True после каждой строки выдаётся TraceStep только с изменениями,
+    последний TraceStep содержит итоговые проверки.
+    В список records складываются сами записи (для build_sections),
+    в listing — строки с адресами их кода (для отчётов симулятора)."""
+    state = FirstPassState(op_table_dict, adr_method, trace, records)
+
+    # Обработчик строки выбирается одним поиском по мнемонике
+    dispatch = {mnemonic: INSTRUCTION for mnemonic in op_table_dict}
+    dispatch.update(DIRECTIVES)
+
+    for line in parsed_lines:
+        if state.end_found:
+            # lineErr("Команда после END")
+            break
+        # Поток из iter_parse_assembly: (номер строки, строка или ошибка разбора)
+        number = None
+        if isinstance(line, tuple):
+            number, line = line
+            if isinstance(line, str):
+                state.errors.append(line)
+                continue
+
+        directive = dispatch.get(line.command.mnemonic, UNKNOWN_COMMAND)
+        if directive.needs_start and not state.start_found:
+            state.line_error("Программа не начинается с директивы START")
+        # Обработка меток
+        if directive.binds_label and line.label:
+            state.define_label(line.label)
+        location_counter = state.location_counter
+        directive.handle(state, line)
+        # START/CSECT меняют секцию, их строки в листинг не попадают
+        if (
+            listing is not None
+            and directive.binds_label
+            and state.location_counter != location_counter
+        ):
+            listing.append(ListingLine(state.current_section, location_counter, line, number))
+        if trace and directive.emits_step:
+            yield state.trace_step()
 
     # Финальные проверки
-    if not start_found:
-        errors.append("Отсутствует директива START")
-    if not end_found:
-        errors.append("Отсутствует директива END")
-
-    if addr_err := validate_address_range(location_counter, "конечный адрес"):
-        errors.append(addr_err)
-
-    # Проверка на корректность тси
-    # Будто бы мы должны делать это после каждой секции
-    # for section in symbol_table:
-    #     for name in symbol_table[section]:
-    #         symbol = symbol_table[section][name]
-    #         if symbol["addr"] is None and symbol["type"] != "EXTREF":
-    #             errors.append(f"Есть ссылка на несуществующее символическое имя {i}")
-
-    yield result()
+    if not state.start_found:
+        state.errors.append("Отсутствует директива START")
+    if not state.end_found:
+        state.errors.append("Отсутствует директива END")
+
+    if addr_err := validate_address_range(state.location_counter, "конечный адрес"):
+        state.errors.append(addr_err)
+
+    yield state.trace_step() if trace else state.result()
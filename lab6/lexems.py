@@ -1,26 +1,117 @@
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
 from typing import *
 
+from symbol_table import *
+from symbol_table import _EXTREF
+
+
+class ResolutionKind:
+    RESOLVED = 0
+    # Имя ещё не определено, значение подставит исправление
+    PENDING = 1
+    # Внешнее имя, значение 0 подставит загрузчик
+    EXTERNAL = 2
+    ERROR = 3
+
+
+@dataclass(frozen=True, slots=True)
+class Resolution:
+    """Результат разрешения операнда: вместо исключений KeyError/ValueError.
+    Неизменяем: результаты без значения — общие экземпляры"""
+
+    kind: int
+    value: int = 0
+    error: str | None = None
+
+    @property
+    def has_value(self) -> bool:
+        return self.kind == ResolutionKind.RESOLVED or self.kind == ResolutionKind.EXTERNAL
+
+    def unwrap(self) -> int:
+        """Значение или исключение, как раньше бросал resolve_value"""
+        if self.kind == ResolutionKind.PENDING:
+            raise KeyError(self.error)
+        if self.kind == ResolutionKind.ERROR:
+            raise ValueError(self.error)
+        return self.value
+
+
+EXTERNAL = Resolution(ResolutionKind.EXTERNAL, 0)
+RELATIVE_EXTERNAL = Resolution(
+    ResolutionKind.ERROR, error="Внешняя ссылка в относительной адресации"
+)
+# Неопределённое имя: по результату на имя, с сообщением для прямой и
+# для относительной адресации
+_PENDING: Dict[str, Resolution] = {}
+_PENDING_RELATIVE: Dict[str, Resolution] = {}
+
+
+def _pending(name: str, relative: bool) -> Resolution:
+    cache = _PENDING_RELATIVE if relative else _PENDING
+    if (res := cache.get(name)) is None:
+        sep = ":" if relative else ""
+        res = cache[name] = Resolution(
+            ResolutionKind.PENDING, error=f"Неизвестное символическое имя{sep} {name}"
+        )
+    return res
+
+
 class Operand:
+    __slots__ = ()
+
     def size(self):
         """Размер в байтах при использовании в данных (BYTE/WORD)"""
         pass
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
-        """Получение числового значения (для непосредственных операндов)"""
+    def resolve_value(self, symbols=None, idr=0):
+        """Получение числового значения (для непосредственных операндов).
+        symbols — имена текущей секции (SymbolTable.sections[секция])"""
         pass
 
+    def resolve(self, symbols=None, idr=0) -> Resolution:
+        """Разрешение без исключений, у непосредственных операндов значение всегда есть"""
+        return Resolution(ResolutionKind.RESOLVED, self.resolve_value())
+
+    def try_resolve(self, symbols=None, idr=0):
+        """Значение или, если его нет, Resolution. Для частых путей: на
+        разрешённый операнд ничего не выделяется, EXTERNAL даёт 0"""
+        return self.resolve_value()
+
+
+def resolve_operands(
+    ops: Iterable[Operand], symbols: Dict[str, Symbol] | None = None, idr=0
+) -> Tuple[List[int] | None, Resolution | None]:
+    """Значения всех операндов или первый неразрешённый результат"""
+    vals = []
+    for op in ops:
+        value = op.try_resolve(symbols, idr)
+        if type(value) is Resolution:
+            return None, value
+        vals.append(value)
+    return vals, None
+
 
-@dataclass
+def operand_signature(operands: Iterable[Operand]) -> Tuple[type, ...]:
+    """Кортеж типов операндов, например (Register, Register)"""
+    return tuple(map(type, operands))
+
+
+@dataclass(slots=True)
 class ParsedCommand:
     mnemonic: str
     operands: List[Operand]
+    # Вычисляется один раз при разборе, по нему выбираются проверки и кодирование
+    signature: Tuple[type, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.signature = operand_signature(self.operands)
 
     def __str__(self):
         return f"{self.mnemonic} {", ".join(map(str, self.operands))}"
 
 
-@dataclass
+@dataclass(slots=True)
 class ParsedLine:
     label: str
     command: ParsedCommand
@@ -29,55 +120,87 @@ class ParsedLine:
         return (f"{self.label}: " if self.label else "") + str(self.command)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Identifier(Operand):
     data: str
 
+    def __post_init__(self):
+        # Одни и те же имена встречаются в программе тысячи раз
+        object.__setattr__(self, "data", sys.intern(self.data))
+
     def __str__(self):
         return self.data
 
     def size(self):
         return 3
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
-        try:
-            record = symbol_table[section][self.data]
-            if record['type'] == "EXTREF":
+    def try_resolve(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        symbol = symbols.get(self.data) if symbols is not None else None
+        if symbol is not None:
+            if symbol.type is _EXTREF:
+                return 0
+            if symbol.addr is not None:
+                return symbol.addr
+        return _pending(self.data, False)
+
+    def resolve(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        symbol = symbols.get(self.data) if symbols is not None else None
+        if symbol is not None:
+            if symbol.type is _EXTREF:
+                return EXTERNAL
+            if symbol.addr is not None:
+                return Resolution(ResolutionKind.RESOLVED, symbol.addr)
+        return _pending(self.data, False)
+
+    def resolve_value(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        symbol = symbols.get(self.data) if symbols is not None else None
+        if symbol is not None:
+            if symbol.type is _EXTREF:
                 return 0
-            if record['addr'] is None:
-                raise KeyError()
-            return record['addr']
-        except:
-            raise KeyError(f"Неизвестное символическое имя {self.data}")
+            if symbol.addr is not None:
+                return symbol.addr
+        return _pending(self.data, False).unwrap()
 
 
-@dataclass
+def relative_offset(addr: int, idr: int) -> int:
+    """Смещение от следующей команды idr до addr, отрицательное в доп. коде"""
+    dlta = addr - idr
+    adlta = abs(dlta)
+    return adlta if dlta > 0 else ((~adlta + 1) & 0xFFFF)
+
+
+@dataclass(frozen=True, slots=True)
 class RelativeIdentifier(Operand):
     data: str
 
+    def __post_init__(self):
+        object.__setattr__(self, "data", sys.intern(self.data))
+
     def __str__(self):
         return f"[{self.data}]"
 
     def size(self):
         return 2
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
-        try:
-            record = symbol_table[section][self.data]
-            if record['type'] == "EXTREF":
-                raise ValueError("Внешняя ссылка")
-            if record['type'] is None and record['addr'] is None:
-                raise KeyError()
-            dlta = record['addr'] - idr
-            adlta = abs(dlta)
-            return adlta if dlta > 0 else ((~adlta + 1) & 0xFFFF)
-        except ValueError:
-            raise ValueError("Внешняя ссылка в относительной адресации")
-        except:
-            raise KeyError(f"Неизвестное символическое имя: {self.data}")
-
-
-@dataclass
+    def try_resolve(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        symbol = symbols.get(self.data) if symbols is not None else None
+        if symbol is not None:
+            if symbol.type is _EXTREF:
+                return RELATIVE_EXTERNAL
+            if symbol.addr is not None:
+                return relative_offset(symbol.addr, idr)
+        return _pending(self.data, True)
+
+    def resolve(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        value = self.try_resolve(symbols, idr)
+        return value if type(value) is Resolution else Resolution(ResolutionKind.RESOLVED, value)
+
+    def resolve_value(self, symbols: Dict[str, Symbol] | None = None, idr=0):
+        value = self.try_resolve(symbols, idr)
+        return value if type(value) is not Resolution else value.unwrap()
+
+
+@dataclass(frozen=True, slots=True)
 class Number(Operand):
     value: int
 
@@ -87,25 +210,25 @@ class Number(Operand):
     def size(self):
         return 1
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
+    def resolve_value(self, symbols=None, idr=0):
         return self.value
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Register(Operand):
     reg: int
 
     def __str__(self):
         return f"R{self.reg:X}"
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
+    def resolve_value(self, symbols=None, idr=0):
         return self.reg & 0xF
 
     def size(self):
         return 0
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CString(Operand):
     data: str
 
@@ -115,11 +238,11 @@ class CString(Operand):
     def size(self):
         return len(self.data)
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
+    def resolve_value(self, symbols=None, idr=0):
         return int("".join(map(lambda x: f"{ord(x):02x}", self.data)), 16)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class XString(Operand):
     data: str
 
@@ -129,14 +252,37 @@ class XString(Operand):
     def size(self):
         return (len(self.data) + 1) // 2
 
-    def resolve_value(self, symbol_table=None, section=None, idr=0):
+    def resolve_value(self, symbols=None, idr=0):
         return int(self.data, 16)
 
 
+# Общие экземпляры для регистров и небольших чисел: операнды неизменяемы,
+# поэтому их можно разделять между всеми строками программы
+_registers = tuple(Register(i) for i in range(16))
+_small_numbers = tuple(Number(i) for i in range(-128, 256))
+
+
+def make_register(reg: int) -> Register:
+    if 0 <= reg < 16:
+        return _registers[reg]
+    return Register(reg)
+
+
+def make_number(value: int) -> Number:
+    if -128 <= value < 256:
+        return _small_numbers[value + 128]
+    return Number(value)
+
+
 def match_op_pattern(operands: List[Operand], *pattern: List[Type]) -> bool:
-    return len(operands) == len(pattern) and all(
-        isinstance(op, tp) for op, tp in zip(operands, pattern)
-    )
+    # Классы операндов не наследуются друг от друга, поэтому isinstance
+    # для каждого операнда равносилен сравнению сигнатур
+    return operand_signature(operands) == pattern
+
+
+STRING_SIGNATURES = frozenset({(CString,), (XString,)})
+DATA_SIGNATURES = frozenset({(Number,), (CString,), (XString,)})
+ADDRESS_SIGNATURES = frozenset({(), (Number,)})
 
 
 def get_operand_with_type(operand, expected_type, description):
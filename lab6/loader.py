@@ -0,0 +1,194 @@
+# Двухпроходный связывающий загрузчик.
+# Проход 1: адреса секций и таблица внешних имён ESTAB по записям H/D.
+# Проход 2: коды секций в один заранее выделенный bytearray и записи M.
+from itertools import chain
+from time import perf_counter
+
+from object_code import *
+from object_file import MAGIC, ObjectFile
+from memory_image import MemoryImage
+
+try:
+    # Необязательно: пакетное применение записей M
+    import numpy
+except ImportError:
+    numpy = None
+
+# Поле адреса, которое правит запись M: 3 байта после кода операции
+RELOCATION_FIELD = 3
+# С какого числа записей M выгоднее векторная правка
+VECTORIZE_THRESHOLD = 256
+
+
+@dataclass(slots=True)
+class LoadedSection:
+    name: str
+    # Адрес загрузки секции и сдвиг её адресов относительно ассемблирования
+    address: int
+    delta: int
+    section: SectionCode
+
+
+@dataclass(slots=True)
+class LoadResult:
+    # bytearray или срез MemoryImage, если загрузка шла в общий образ
+    memory: bytearray | memoryview
+    # Адрес загрузки программы: memory[0] соответствует этому адресу
+    start: int
+    entry: int | None
+    estab: Dict[str, int]
+    sections: List[LoadedSection]
+    errors: List[str]
+    # Время каждого прохода в секундах
+    timings: Dict[str, float]
+
+
+def read_module(path: str) -> List[SectionCode]:
+    """Секции объектного файла: двоичного (object_file) или текстового"""
+    with open(path, "rb") as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        with ObjectFile(path) as obj:
+            return obj.sections()
+    with open(path, encoding="utf-8") as f:
+        return read_object_text(line.rstrip("\n") for line in f if line.strip())
+
+
+def build_estab(
+    sections: Iterable[SectionCode], start: int, errors: List[str]
+) -> Tuple[Dict[str, int], List[LoadedSection], int]:
+    """Проход 1: секции подряд с адреса start, ESTAB из имён секций и D-записей"""
+    estab: Dict[str, int] = {}
+    loaded = []
+    address = start
+
+    def define(name: str, value: int) -> None:
+        if name in estab:
+            errors.append(f"Повторное внешнее имя {name}")
+        else:
+            estab[name] = value
+
+    for section in sections:
+        delta = address - section.start
+        define(section.name, address)
+        for name, addr in section.definitions:
+            define(name, addr + delta)
+        loaded.append(LoadedSection(section.name, address, delta, section))
+        address += section.size
+    return estab, loaded, address - start
+
+
+def collect_relocations(
+    loaded: List[LoadedSection], estab: Dict[str, int], start: int, size: int, errors: List[str]
+) -> List[Tuple[int, int]]:
+    """(смещение поля в образе, добавка) для каждой записи M"""
+    relocations = []
+    for item in loaded:
+        for adr, name in item.section.modifications:
+            if name is None:
+                addend = item.delta
+            elif (addend := estab.get(name)) is None:
+                errors.append(f"[{item.name}:{adr:06X}]: Не определено внешнее имя {name}")
+                continue
+            offset = adr + item.delta + 1 - start
+            if not (0 <= offset <= size - RELOCATION_FIELD):
+                errors.append(f"[{item.name}:{adr:06X}]: Запись M вне образа программы")
+                continue
+            relocations.append((offset, addend))
+    return relocations
+
+
+def apply_relocations_scalar(memory: bytearray | memoryview, relocations: Iterable[Tuple[int, int]]) -> None:
+    """Прибавляет добавки к 3-байтным полям адреса (по модулю 2^24)"""
+    for offset, addend in relocations:
+        end = offset + RELOCATION_FIELD
+        value = (int.from_bytes(memory[offset:end], "big") + addend) & 0xFFFFFF
+        memory[offset:end] = value.to_bytes(RELOCATION_FIELD, "big")
+
+
+def apply_relocations_vectorized(memory: bytearray | memoryview, relocations: List[Tuple[int, int]]) -> bool:
+    """То же через NumPy: собрать поля, сложить, разложить обратно.
+    Добавки к одному полю суммируются. Если поля перекрываются, перенос
+    между ними зависит от порядка — тогда False и нужен скалярный путь."""
+    pairs = numpy.fromiter(
+        chain.from_iterable(relocations), dtype=numpy.int64, count=2 * len(relocations)
+    ).reshape(-1, 2)
+    offsets, inverse = numpy.unique(pairs[:, 0], return_inverse=True)
+    if len(offsets) > 1 and numpy.diff(offsets).min() < RELOCATION_FIELD:
+        return False
+    addends = numpy.zeros(len(offsets), dtype=numpy.int64)
+    numpy.add.at(addends, inverse.reshape(-1), pairs[:, 1])
+
+    image = numpy.frombuffer(memory, dtype=numpy.uint8)
+    values = (
+        (image[offsets].astype(numpy.int64) << 16)
+        | (image[offsets + 1].astype(numpy.int64) << 8)
+        | image[offsets + 2]
+    )
+    values = (values + addends) & 0xFFFFFF
+    image[offsets] = values >> 16
+    image[offsets + 1] = (values >> 8) & 0xFF
+    image[offsets + 2] = values & 0xFF
+    return True
+
+
+def apply_relocations(memory: bytearray | memoryview, relocations: List[Tuple[int, int]]) -> None:
+    if (
+        numpy is not None
+        and len(relocations) >= VECTORIZE_THRESHOLD
+        and apply_relocations_vectorized(memory, relocations)
+    ):
+        return
+    apply_relocations_scalar(memory, relocations)
+
+
+def load_sections(
+    sections: List[SectionCode], start: int = 0, image: MemoryImage | None = None
+) -> LoadResult:
+    """Связывание и загрузка. С image программа пишется прямо в образ памяти
+    с адреса start, иначе в отдельный bytearray"""
+    errors: List[str] = []
+    timings: Dict[str, float] = {}
+
+    begin = perf_counter()
+    estab, loaded, size = build_estab(sections, start, errors)
+    timings["estab"] = perf_counter() - begin
+
+    begin = perf_counter()
+    if image is None:
+        memory = bytearray(size)
+    elif start + size > len(image):
+        errors.append(f"Программа размером {size:X} не помещается в память с адреса {start:06X}")
+        return LoadResult(bytearray(), start, None, estab, loaded, errors, timings)
+    else:
+        memory = image.slice(start, size)
+        # Образ может быть уже использован: пропуски между T-записями обнуляются
+        memory[:] = bytes(size)
+    for item in loaded:
+        section = item.section
+        length = min(len(section.code), section.size)
+        offset = item.address - start
+        # Код секции уже собран из T-записей, пропуски в нём нулевые
+        memory[offset : offset + length] = memoryview(section.code)[:length]
+    timings["load"] = perf_counter() - begin
+
+    begin = perf_counter()
+    apply_relocations(memory, collect_relocations(loaded, estab, start, size, errors))
+    timings["relocate"] = perf_counter() - begin
+
+    entry = None
+    if loaded and loaded[0].section.entry is not None:
+        entry = loaded[0].section.entry + loaded[0].delta
+    return LoadResult(memory, start, entry, estab, loaded, errors, timings)
+
+
+def load_modules(
+    paths: Iterable[str], start: int = 0, image: MemoryImage | None = None
+) -> LoadResult:
+    """Загрузка объектных файлов в указанном порядке, чтение тоже замеряется"""
+    begin = perf_counter()
+    sections = [section for path in paths for section in read_module(path)]
+    read_time = perf_counter() - begin
+    result = load_sections(sections, start, image)
+    result.timings = {"read": read_time, **result.timings}
+    return result
@@ -5,7 +5,7 @@ from PySide6.QtWidgets import QApplication, QMainWindow
 from PySide6.QtWidgets import QTableWidget, QTableWidgetItem
 
 from parser import *
-from first_pass import first_pass_simple_dict
+from first_pass import first_pass_simple_dict, TraceStep
 from second_pass import second_pass
 
 # Important:
@@ -73,25 +73,26 @@ def table_to_dict(table_widget) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
 
     return errs, result_dict
 
-def fill_symbol_table_sorted_by_address(table_widget: QTableWidget, symbol_table):
+def fill_symbol_table_sorted_by_address(table_widget: QTableWidget, symbol_table: SymbolTable):
     table_widget.clear()
     table_widget.setRowCount(0)
 
     table_widget.setColumnCount(4)
     table_widget.setHorizontalHeaderLabels(["Метка", "Адрес", "Секция", "Тип"])
 
-    table_widget.setRowCount(sum(len(symbol_table[i]) for i in symbol_table))
+    table_widget.setRowCount(len(symbol_table))
     row = 0
-    for section_name in symbol_table:
-        section = list(symbol_table[section_name].items())
-        section.sort(key=lambda x: x[1]["addr"] if x[1]["addr"] is not None else -1)
-        for label, record in section:
-            label_item = QTableWidgetItem(label)
+    for section_name, symbols in symbol_table.sections.items():
+        section = sorted(
+            symbols.values(), key=lambda x: x.addr if x.addr is not None else -1
+        )
+        for record in section:
+            label_item = QTableWidgetItem(record.name)
             address_item = QTableWidgetItem(
-                f"0x{record["addr"]:06x}" if record["addr"] is not None else "None"
+                f"0x{record.addr:06x}" if record.addr is not None else "None"
             )
             section_item = QTableWidgetItem(section_name)
-            type_item = QTableWidgetItem(record["type"])
+            type_item = QTableWidgetItem(record.type.value)
             table_widget.setItem(row, 0, label_item)
             table_widget.setItem(row, 1, address_item)
             table_widget.setItem(row, 2, section_item)
@@ -113,6 +114,8 @@ class MainWindow(QMainWindow):
         self.ui.tracePass.clicked.connect(self.trace_pass)
         self.ui.clearFirst.clicked.connect(lambda: self.ui.firstPassErr.clear())
 
+        # Разбор правится по диапазону изменения, затем пересборка по textChanged
+        self.ui.srcCode.document().contentsChange.connect(self.on_source_contents_change)
         self.ui.srcCode.textChanged.connect(self.on_source_code_changed)
 
         self.ui.chooseAdrMethod.activated.connect(self.on_source_code_changed)
@@ -126,10 +129,30 @@ class MainWindow(QMainWindow):
     def init_structures(self):
         self.symbol_table = None
         self.op_table = None
+        self.source_parser = IncrementalParser()
+        self.source_parser.update(self.ui.srcCode.toPlainText())
+        self.first_pass_gen = None
+        self.first_pass_input = None
+        self.trace_symbols = SymbolTable()
 
     def on_source_code_changed(self):
         self.reset_compilation_state()
 
+    def on_source_contents_change(self, position: int, removed: int, added: int):
+        """Переразбор только строк, задетых правкой"""
+        document = self.ui.srcCode.document()
+        block = document.findBlock(position)
+        first = block.blockNumber()
+        count = self.source_parser.lines_spanned(first, position - block.position(), removed)
+        end = document.findBlock(position + added)
+        if not end.isValid():
+            end = document.lastBlock()
+        lines = []
+        while block.isValid() and block.blockNumber() <= end.blockNumber():
+            lines.append(block.text())
+            block = block.next()
+        self.source_parser.edit(first, count, lines)
+
     def print_results(self, res_table, symbol_table, errs):
         self.ui.binaryCode.clear()
         if res_table:
@@ -143,24 +166,40 @@ class MainWindow(QMainWindow):
         self.ui.firstPassErr.clear()
         self.ui.firstPassErr.addItems(errs)
     
+    def apply_trace_step(self, step: TraceStep, refresh: bool = True):
+        self.ui.binaryCode.addItems(step.records)
+        for inx, text in step.patched:
+            self.ui.binaryCode.item(inx).setText(text)
+        for symbol in step.symbols:
+            self.trace_symbols.add(symbol)
+        self.ui.firstPassErr.addItems(step.errors)
+        if refresh:
+            fill_symbol_table_sorted_by_address(self.ui.symbolicNameTable, self.trace_symbols)
+
     def trace_pass(self):
-        # res_table, symbol_table, errs = self.first_pass_gen.next()
+        if self.first_pass_gen is None:
+            if self.first_pass_input is None:
+                return
+            self.first_pass_gen = first_pass_simple_dict(*self.first_pass_input, trace=True)
+            self.trace_symbols = SymbolTable()
+            self.print_results(None, None, [])
         try:
-            self.print_results(*next(self.first_pass_gen))
+            self.apply_trace_step(next(self.first_pass_gen))
         except StopIteration:
             pass
-        except TypeError as err:
-            raise err
     
     def reset_compilation_state(self):
         self.first_pass_gen = None
+        self.first_pass_input = None
         self.ui.binaryCode.clear()
         self.ui.firstPassErr.clear()
         self.ui.symbolicNameTable.clear()
         self.ui.symbolicNameTable.setRowCount(0)
         
-        text_src = self.ui.srcCode.toPlainText()
-        parsed_lines, parse_errors = parse_assembly(text_src)
+        # Списки уже поправлены в on_source_contents_change; начатый по ним
+        # проход сбрасывается выше при каждой правке
+        parsed_lines = self.source_parser.results
+        parse_errors = self.source_parser.errors
         op_table_check_errs, op_table = table_to_dict(self.ui.codeTable)
 
         self.ui.firstPassErr.addItems(parse_errors)
@@ -170,17 +209,23 @@ class MainWindow(QMainWindow):
             return
 
         method = self.ui.chooseAdrMethod.currentIndex()
-        self.first_pass_gen = first_pass_simple_dict(parsed_lines, op_table, method)
+        # Проход запускается по кнопке: целиком или по шагам трассировки
+        self.first_pass_input = (parsed_lines, op_table, method)
 
         self.update_ui_state()
 
     def first_pass(self):
-        try:
-            self.print_results(*deque(self.first_pass_gen, maxlen=1)[-1])
-        except IndexError:
-            pass
-        except TypeError:
-            pass
+        if self.first_pass_input is None:
+            return
+        if self.first_pass_gen is not None:
+            # Трассировка уже начата: досчитываем оставшиеся шаги
+            for step in self.first_pass_gen:
+                self.apply_trace_step(step, refresh=False)
+            fill_symbol_table_sorted_by_address(self.ui.symbolicNameTable, self.trace_symbols)
+            return
+        self.print_results(
+            *deque(first_pass_simple_dict(*self.first_pass_input), maxlen=1)[-1]
+        )
 
     
     def update_ui_state(self):
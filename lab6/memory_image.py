@@ -0,0 +1,104 @@
+# Память машины: всё 24-битное адресное пространство в одном mmap.
+# Страницы выделяются системой при первом обращении, поэтому образ
+# на 16 МБ занимает столько, сколько страниц реально тронуто.
+import mmap
+import os
+import struct
+
+ADDRESS_SPACE = 0x1000000
+
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+
+class MemoryImage:
+    """Образ памяти: анонимный или отображённый на файл (path). С private
+    файл отображается только для чтения с копированием при записи: страницы
+    общие с другими отображениями, пока в них не пишут, и файл не меняется"""
+
+    __slots__ = ("map", "view", "path")
+
+    def __init__(
+        self, path: str | None = None, size: int = ADDRESS_SPACE, private: bool = False
+    ):
+        self.path = path
+        if path is None:
+            self.map = mmap.mmap(-1, size)
+        elif private:
+            with open(path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+        else:
+            # Файл нужного размера создаётся разреженным (truncate)
+            with open(path, "a+b") as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+                self.map = mmap.mmap(f.fileno(), size)
+        self.view = memoryview(self.map)
+
+    def __len__(self) -> int:
+        return len(self.map)
+
+    def close(self) -> None:
+        """Все срезы из slice() к этому моменту должны быть освобождены"""
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flush(self) -> None:
+        self.map.flush()
+
+    def slice(self, adr: int, length: int) -> memoryview:
+        """Срез памяти без копирования, запись в него меняет образ"""
+        return self.view[adr : adr + length]
+
+    def load(self, adr: int, data) -> None:
+        self.view[adr : adr + len(data)] = data
+
+    def read(self, adr: int, size: int) -> int:
+        """Беззнаковое big-endian значение из size (1..4) байт"""
+        return int.from_bytes(self.view[adr : adr + size], "big")
+
+    def write(self, adr: int, value: int, size: int) -> None:
+        mask = (1 << (8 * size)) - 1
+        self.view[adr : adr + size] = (value & mask).to_bytes(size, "big")
+
+    def read8(self, adr: int) -> int:
+        return self.view[adr]
+
+    def write8(self, adr: int, value: int) -> None:
+        self.view[adr] = value & 0xFF
+
+    def read16(self, adr: int) -> int:
+        return _U16.unpack_from(self.map, adr)[0]
+
+    def write16(self, adr: int, value: int) -> None:
+        _U16.pack_into(self.map, adr, value & 0xFFFF)
+
+    def read24(self, adr: int) -> int:
+        return int.from_bytes(self.view[adr : adr + 3], "big")
+
+    def write24(self, adr: int, value: int) -> None:
+        self.view[adr : adr + 3] = (value & 0xFFFFFF).to_bytes(3, "big")
+
+    def read32(self, adr: int) -> int:
+        return _U32.unpack_from(self.map, adr)[0]
+
+    def write32(self, adr: int, value: int) -> None:
+        _U32.pack_into(self.map, adr, value & 0xFFFFFFFF)
+
+    def dump(self, path: str, adr: int = 0, length: int | None = None) -> None:
+        """Сохранение участка образа в файл прямо из mmap"""
+        if length is None:
+            length = len(self.map) - adr
+        with open(path, "wb") as f:
+            f.write(self.view[adr : adr + length])
+
+    def restore(self, path: str, adr: int = 0) -> int:
+        """Чтение файла прямо в образ с адреса adr, возвращает число байт"""
+        with open(path, "rb") as f:
+            return f.readinto(self.view[adr:])
@@ -0,0 +1,167 @@
+# Объектный код в байтах: кодирование команд и данных, образы секций.
+# Текстовые записи H/D/R/T/M/E получаются из байтов только при выводе.
+from lexems import *
+
+
+# Наибольшая длина данных T-записи при упаковке, байт
+T_RECORD_LENGTH = 30
+
+
+def hex_text(data) -> str:
+    return data.hex().upper()
+
+
+def _pad_hex(data: str, width: int) -> str:
+    return "0" * ((width - (len(data) % width)) % width) + data
+
+
+def _word(value: int) -> bytes:
+    return (value & 0xFFFFFF).to_bytes(3, "big")
+
+
+# Данные директив BYTE/WORD по сигнатуре операнда
+BYTE_DATA = {
+    (Number,): lambda op: bytes((op.value & 0xFF,)),
+    (CString,): lambda op: bytes(ord(c) & 0xFF for c in op.data),
+    (XString,): lambda op: bytes.fromhex(_pad_hex(op.data, 2)),
+}
+
+WORD_DATA = {
+    (Number,): lambda op: _word(op.value),
+    (CString,): lambda op: b"".join(_word(ord(c)) for c in op.data),
+    (XString,): lambda op: bytes.fromhex(_pad_hex(op.data, 6)),
+}
+
+
+def byte_data(ops: List[Operand]) -> bytes | None:
+    if encode := BYTE_DATA.get(operand_signature(ops)):
+        return encode(ops[0])
+
+
+def word_data(ops: List[Operand]) -> bytes | None:
+    if encode := WORD_DATA.get(operand_signature(ops)):
+        return encode(ops[0])
+
+
+def operand_bytes(size: int, values: List[int]) -> bytes:
+    """Поле операндов команды размера size: два регистра делят один байт,
+    иначе значение занимает все size - 1 байт (big-endian)"""
+    if size <= 1 or not values:
+        return b""
+    if len(values) == 2:
+        return bytes((((values[0] & 0xF) << 4) | (values[1] & 0xF),))
+    width = size - 1
+    return (values[0] & ((1 << (8 * width)) - 1)).to_bytes(width, "big")
+
+
+def encode_instruction(op_addr_code: int, size: int, values: List[int] | None) -> bytes:
+    """Байты команды; пока операнды не разрешены — только код операции"""
+    opcode = bytes((op_addr_code & 0xFF,))
+    if values is None:
+        return opcode
+    return opcode + operand_bytes(size, values)
+
+
+@dataclass(slots=True)
+class SectionCode:
+    """Образ секции: код в bytearray и индекс записей поверх него"""
+
+    name: str
+    start: int
+    size: int
+    code: bytearray = field(default_factory=bytearray)
+    # T-записи по порядку: (адрес, размер, длина данных); после данных — резерв
+    records: List[Tuple[int, int, int]] = field(default_factory=list)
+    definitions: List[Tuple[str, int]] = field(default_factory=list)
+    references: List[str] = field(default_factory=list)
+    modifications: List[Tuple[int, str | None]] = field(default_factory=list)
+    entry: int | None = None
+
+    def write(self, adr: int, size: int, data: bytes) -> None:
+        code = self.code
+        offset = adr - self.start
+        length = len(data)
+        end = offset + (size if size > length else length)
+        if end > len(code):
+            code.extend(bytes(end - len(code)))
+        if length:
+            code[offset : offset + length] = data
+        self.records.append((adr, size, length))
+
+    def view(self, adr: int, length: int) -> memoryview:
+        offset = adr - self.start
+        return memoryview(self.code)[offset : offset + length]
+
+    def coalesce(self, max_length: int = T_RECORD_LENGTH) -> List[Tuple[int, int]]:
+        """Непрерывные участки данных, нарезанные на (адрес, длина) не длиннее
+        max_length; резерв RESB/RESW и прочие пропуски разрывают участок"""
+        runs = []
+        run_start = run_end = None
+        for adr, size, length in self.records:
+            if not length:
+                continue
+            if adr != run_end:
+                if run_start is not None:
+                    runs.append((run_start, run_end))
+                run_start = adr
+            run_end = adr + length
+        if run_start is not None:
+            runs.append((run_start, run_end))
+        return [
+            (adr, min(max_length, end - adr))
+            for start, end in runs
+            for adr in range(start, end, max_length)
+        ]
+
+    def text_records(self, max_length: int | None = None) -> List[str]:
+        """Текстовый объектный модуль секции: H, D, R, T, M, E.
+        Без max_length — T-запись на каждую команду и директиву,
+        иначе данные упакованы в T-записи до max_length байт."""
+        if max_length is None:
+            t_records = self.records
+        else:
+            t_records = [(adr, length, length) for adr, length in self.coalesce(max_length)]
+        lines = [f"H {self.name} {self.start:06X} {self.size:X}"]
+        lines.extend(f"D {name} {addr:06X}" for name, addr in self.definitions)
+        lines.extend(f"R {name}" for name in self.references)
+        lines.extend(
+            f"T {adr:06X} {size:X} {hex_text(self.view(adr, length))}"
+            for adr, size, length in t_records
+        )
+        lines.extend(
+            f"M {adr:06X} {name}" if name else f"M {adr:06X}"
+            for adr, name in self.modifications
+        )
+        if self.entry is not None:
+            lines.append(f"E {self.entry:06X}")
+        return lines
+
+
+def write_object_text(
+    sections: Iterable[SectionCode], max_length: int | None = T_RECORD_LENGTH
+) -> List[str]:
+    """Объектный модуль всех секций с упакованными T-записями"""
+    return [line for section in sections for line in section.text_records(max_length)]
+
+
+def read_object_text(lines: Iterable[str]) -> List[SectionCode]:
+    """Разбор текстового модуля H/D/R/T/M/E обратно в образы секций"""
+    sections: List[SectionCode] = []
+    for line in lines:
+        kind, *fields = line.split(" ")
+        if kind == "H":
+            size = int(fields[2], 16) if len(fields) > 2 else 0
+            sections.append(SectionCode(fields[0], int(fields[1], 16), size, bytearray(size)))
+        elif kind == "T":
+            data = bytes.fromhex(fields[2]) if len(fields) > 2 else b""
+            sections[-1].write(int(fields[0], 16), int(fields[1], 16), data)
+        elif kind == "D":
+            sections[-1].definitions.append((fields[0], int(fields[1] or "0", 16)))
+        elif kind == "R":
+            sections[-1].references.append(fields[0])
+        elif kind == "M":
+            name = fields[1] if len(fields) > 1 else None
+            sections[-1].modifications.append((int(fields[0], 16), name))
+        elif kind == "E":
+            sections[-1].entry = int(fields[0], 16)
+    return sections
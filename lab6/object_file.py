@@ -0,0 +1,215 @@
+# Двоичный объектный файл: заголовок, таблица секций, коды секций и
+# упакованные таблицы D/R/M. Все смещения выровнены, читатель открывает
+# файл через mmap и берёт код или перемещения секции без разбора текста.
+import mmap
+import struct
+
+from object_code import *
+
+MAGIC = b"ASMO"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+NO_NAME = 0xFFFFFFFF
+
+# magic, версия, число секций, смещение таблицы секций, смещение пула имён
+HEADER = struct.Struct("<4sHHII")
+# имя (смещение, длина), начало, размер, точка входа (-1 — нет),
+# код (смещение, длина) и таблицы записей, D, R, M (смещение, количество)
+SECTION_ENTRY = struct.Struct("<IIIIiIIIIIIIIII4x")
+# адрес, размер, длина данных
+RECORD = struct.Struct("<III")
+# имя (смещение, длина), адрес
+DEFINITION = struct.Struct("<III")
+# имя (смещение, длина)
+REFERENCE = struct.Struct("<II")
+# адрес, имя (смещение, длина; NO_NAME — перемещение относительно секции)
+MODIFICATION = struct.Struct("<III")
+
+
+@dataclass(slots=True)
+class SectionEntry:
+    name_offset: int
+    name_length: int
+    start: int
+    size: int
+    entry: int
+    code_offset: int
+    code_length: int
+    records_offset: int
+    records_count: int
+    definitions_offset: int
+    definitions_count: int
+    references_offset: int
+    references_count: int
+    modifications_offset: int
+    modifications_count: int
+
+
+def _align(buffer: bytearray) -> int:
+    buffer.extend(bytes(-len(buffer) % ALIGNMENT))
+    return len(buffer)
+
+
+class _NamePool:
+    """Пул имён в конце файла, одинаковые имена хранятся один раз"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+
+    def add(self, name: str | None) -> Tuple[int, int]:
+        if name is None:
+            return NO_NAME, 0
+        if (ref := self.offsets.get(name)) is None:
+            encoded = name.encode()
+            ref = self.offsets[name] = (len(self.data), len(encoded))
+            self.data.extend(encoded)
+        return ref
+
+
+def _pack_table(buffer: bytearray, layout: struct.Struct, rows: List[tuple]) -> Tuple[int, int]:
+    offset = _align(buffer)
+    buffer.extend(bytes(layout.size * len(rows)))
+    for i, row in enumerate(rows):
+        layout.pack_into(buffer, offset + i * layout.size, *row)
+    return offset, len(rows)
+
+
+def object_file_bytes(sections: List[SectionCode]) -> bytearray:
+    names = _NamePool()
+    buffer = bytearray(HEADER.size)
+    table_offset = _align(buffer)
+    buffer.extend(bytes(SECTION_ENTRY.size * len(sections)))
+
+    entries = []
+    for section in sections:
+        code_offset = _align(buffer)
+        buffer.extend(section.code)
+        records = _pack_table(buffer, RECORD, section.records)
+        definitions = _pack_table(
+            buffer, DEFINITION, [(*names.add(name), addr) for name, addr in section.definitions]
+        )
+        references = _pack_table(
+            buffer, REFERENCE, [names.add(name) for name in section.references]
+        )
+        modifications = _pack_table(
+            buffer, MODIFICATION, [(adr, *names.add(name)) for adr, name in section.modifications]
+        )
+        entries.append(
+            (
+                *names.add(section.name),
+                section.start,
+                section.size,
+                -1 if section.entry is None else section.entry,
+                code_offset,
+                len(section.code),
+                *records,
+                *definitions,
+                *references,
+                *modifications,
+            )
+        )
+
+    names_offset = _align(buffer)
+    buffer.extend(names.data)
+    HEADER.pack_into(buffer, 0, MAGIC, FORMAT_VERSION, len(sections), table_offset, names_offset)
+    for i, entry in enumerate(entries):
+        SECTION_ENTRY.pack_into(buffer, table_offset + i * SECTION_ENTRY.size, *entry)
+    return buffer
+
+
+def write_object_file(path: str, sections: List[SectionCode]) -> None:
+    with open(path, "wb") as f:
+        f.write(object_file_bytes(sections))
+
+
+class ObjectFile:
+    """Чтение двоичного объектного файла через mmap без копирования кода"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version, count, table_offset, self.names_offset = HEADER.unpack_from(self.view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Неподдерживаемый объектный файл {path}")
+        self.entries = [
+            SectionEntry(*SECTION_ENTRY.unpack_from(self.view, table_offset + i * SECTION_ENTRY.size))
+            for i in range(count)
+        ]
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def name(self, offset: int, length: int) -> str | None:
+        if offset == NO_NAME:
+            return None
+        start = self.names_offset + offset
+        return str(self.view[start : start + length], "utf-8")
+
+    def code(self, inx: int) -> memoryview:
+        entry = self.entries[inx]
+        return self.view[entry.code_offset : entry.code_offset + entry.code_length]
+
+    def _table(self, layout: struct.Struct, offset: int, count: int):
+        return layout.iter_unpack(self.view[offset : offset + layout.size * count])
+
+    def records(self, inx: int) -> List[Tuple[int, int, int]]:
+        entry = self.entries[inx]
+        return list(self._table(RECORD, entry.records_offset, entry.records_count))
+
+    def definitions(self, inx: int) -> List[Tuple[str, int]]:
+        entry = self.entries[inx]
+        return [
+            (self.name(offset, length), addr)
+            for offset, length, addr in self._table(
+                DEFINITION, entry.definitions_offset, entry.definitions_count
+            )
+        ]
+
+    def references(self, inx: int) -> List[str]:
+        entry = self.entries[inx]
+        return [
+            self.name(offset, length)
+            for offset, length in self._table(
+                REFERENCE, entry.references_offset, entry.references_count
+            )
+        ]
+
+    def modifications(self, inx: int) -> List[Tuple[int, str | None]]:
+        entry = self.entries[inx]
+        return [
+            (adr, self.name(offset, length))
+            for adr, offset, length in self._table(
+                MODIFICATION, entry.modifications_offset, entry.modifications_count
+            )
+        ]
+
+    def section(self, inx: int) -> SectionCode:
+        """Полная копия секции, например для вывода текстовых записей"""
+        entry = self.entries[inx]
+        return SectionCode(
+            self.name(entry.name_offset, entry.name_length),
+            entry.start,
+            entry.size,
+            bytearray(self.code(inx)),
+            self.records(inx),
+            self.definitions(inx),
+            self.references(inx),
+            self.modifications(inx),
+            None if entry.entry < 0 else entry.entry,
+        )
+
+    def sections(self) -> List[SectionCode]:
+        return [self.section(inx) for inx in range(len(self.entries))]
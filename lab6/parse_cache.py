@@ -0,0 +1,115 @@
+# Дисковый кэш результатов parse_assembly, аналог .pyc для исходников ассемблера
+import hashlib
+import marshal
+import os
+from array import array
+
+from parser import *
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "asm_parse")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ParseCache:
+    """Результаты разбора по хэшу исходника, вытеснение давно не читанных (LRU)"""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Размеры записей и их сумма: считаются по каталогу при открытии и
+        # при вытеснении, store только обновляет их
+        self.sizes: Dict[str, int] = {}
+        self.total = 0
+        self.scan()
+
+    def key(self, source: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{GRAMMAR_VERSION}:{marshal.version}\0".encode())
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".asmc")
+
+    def load(self, key: str) -> Tuple[List[ParsedLine], List[str]] | None:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                version, unique_lines, indices, errors = marshal.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError):
+            # Повреждённая запись
+            self.remove(path)
+            return None
+        if version != GRAMMAR_VERSION:
+            self.remove(path)
+            return None
+        # Время изменения файла служит временем последнего обращения для LRU
+        os.utime(path)
+        lines = decode_parsed_lines(unique_lines)
+        line_indices = array("I")
+        line_indices.frombytes(indices)
+        return ([lines[i] for i in line_indices], list(errors))
+
+    def store(self, key: str, results: List[ParsedLine], errors: List[str]) -> None:
+        # Повторяющиеся строки хранятся один раз, порядок задаётся массивом индексов
+        unique_lines = {}
+        indices = array(
+            "I",
+            (unique_lines.setdefault(line, len(unique_lines)) for line in encode_parsed_lines(results)),
+        )
+        data = marshal.dumps(
+            (GRAMMAR_VERSION, tuple(unique_lines), indices.tobytes(), tuple(errors))
+        )
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.total += len(data) - self.sizes.get(path, 0)
+        self.sizes[path] = len(data)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def scan(self) -> List[Tuple[float, int, str]]:
+        """Пересчёт размеров по каталогу (его могут менять и другие процессы).
+        Возвращает записи (время обращения, размер, путь)"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".asmc"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        self.sizes = {path: size for _, size, path in entries}
+        self.total = sum(self.sizes.values())
+        return entries
+
+    def evict(self) -> None:
+        entries = self.scan()
+        entries.sort()
+        for _, _, path in entries:
+            if self.total <= self.max_bytes:
+                break
+            self.remove(path)
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.total -= self.sizes.pop(path, 0)
+
+    def parse(self, source: str) -> Tuple[List[ParsedLine], List[str]]:
+        key = self.key(source)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        results, errors = parse_assembly(source)
+        self.store(key, results, errors)
+        return (results, errors)
+
+
+def cached_parse_assembly(source: str, cache: ParseCache | None = None) -> Tuple[List[ParsedLine], List[str]]:
+    return (cache or ParseCache()).parse(source)
@@ -1,3 +1,6 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from lexems import *
 from parsec import *
 
@@ -56,7 +59,7 @@ def number_parser():
     res = yield (
          hexadecimal_number_parser ^ binary_number_parser ^ octal_number_parser ^ decimal_number_parser
     )
-    return Number(res)
+    return make_number(res)
 
     # vx = lambda br: string(pref) >> string(br) >> many(none_of(br)) << string(br)
     # res = yield vx('"') ^ vx("'")
@@ -77,40 +80,66 @@ def number_parser():
 #     res = yield string_parser("x")
 #     return XString(res)
 
-@generate
-def xstring_parser():
-    quote = yield string("x") >> one_of("'\"")
-    chars = yield regex(r"[0-9A-Fa-f]+") << string(quote)
-    return XString("".join(chars))
+_xstring_re = re.compile(r"x(['\"])([0-9A-Fa-f]+)\1")
+
+
+@Parser
+def xstring_parser(text, index):
+    m = _xstring_re.match(text, index)
+    if m is None:
+        return Value.failure(index, "x-string")
+    return Value.success(m.end(), XString(m.group(2)))
+
 
 # @generate
 # def cstring_parser():
 #     res = yield string_parser("c")
 #     return CString(res)
 
-@generate
-def cstring_parser():
-    quote = yield string("c") >> one_of("'\"")
-    @generate
-    def go():
-        chars = yield (many(none_of(quote+";")) >> string(";") >> spaces() >> string(quote) >> many(any())) ^ (spaces() >> string(quote) >> many(any()))
-        # chars = yield (many(none_of(quote)) >> string(";") >> spaces() >> string(quote) >> many(any()))
-        return chars
-    chars = yield many(any())
-    chars = "".join(chars)[::-1]
-    try:
-        chars = "".join(go.parse(chars)[::-1])
-    except ParseError:
-        yield fail_with("Not in quotes")
-    # print(f"({chars})")
-    return CString(chars)
+
+def scan_cstring(text: str, index: int) -> Tuple[str, int] | None:
+    """Однопроходный разбор c'...': строка занимает остаток строки исходника.
+
+    Закрывающей считается последняя кавычка, за которой до конца строки идут
+    только пробелы либо пробелы и комментарий без кавычек и ';'.
+    Возвращает (содержимое, конец разобранного текста) или None."""
+    start = index + 2
+    if text[index : index + 1] != "c" or text[index + 1 : index + 2] not in ("'", '"'):
+        return None
+    quote = text[index + 1]
+    end = len(text)
+
+    # Последний из символов quote/';' -- начало комментария после литерала
+    sep = max(text.rfind(quote, start), text.rfind(";", start))
+    if sep >= start and text[sep] == ";":
+        close = sep - 1
+        while close >= start and text[close].isspace():
+            close -= 1
+        if close >= start and text[close] == quote:
+            return text[start:close], end
+
+    close = end - 1
+    while close >= start and text[close].isspace():
+        close -= 1
+    if close >= start and text[close] == quote:
+        return text[start:close], end
+    return None
+
+
+@Parser
+def cstring_parser(text, index):
+    scanned = scan_cstring(text, index)
+    if scanned is None:
+        return Value.failure(len(text), "Not in quotes")
+    data, end = scanned
+    return Value.success(end, CString(data))
 
 @generate
 def register_parser():
     pref = one_of("Rr") >> decimal_number_parser
     x = yield exclude(pref, pref >> identifier_parser)
     if 0 <= x < 16:
-        return Register(x)
+        return make_register(x)
     else:
         yield fail_with(f"Invalid register number: {x}. Must be between 0 and 15")
 
@@ -168,17 +197,388 @@ def line_parser():
     return res
 
 
-def parse_assembly(source: str) -> Tuple[List[ParsedLine], List[str]]:
-    lines = source.split("\n")
-    errors = []
+# Быстрый разбор строки без комбинаторов: операнд выбирается по первому символу.
+# Если строка не укладывается в простые случаи, возвращается UNCLASSIFIED и
+# строка разбирается грамматикой line_parser (с её сообщениями об ошибках).
+UNCLASSIFIED = object()
+
+_spaces_re = re.compile(r"\s*")
+_identifier_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_register_re = re.compile(r"[Rr](-?[0-9]+)(?![A-Za-z_])")
+_number_re = re.compile(r"(-?)(?:0x([0-9A-Fa-f]+)|0b([01]+)|0o([0-7]+)|([0-9]+))")
+
+
+def _scan_identifier(line: str, i: int):
+    m = _identifier_re.match(line, i)
+    if m is None:
+        return None
+    return Identifier(m.group()), m.end()
+
+
+def _scan_register(line: str, i: int):
+    m = _register_re.match(line, i)
+    if m is not None:
+        reg = int(m.group(1))
+        if 0 <= reg < 16:
+            return make_register(reg), m.end()
+    return _scan_identifier(line, i)
+
+
+def _scan_number(line: str, i: int):
+    m = _number_re.match(line, i)
+    if m is None:
+        return None
+    sign, hex_digits, bin_digits, oct_digits, dec_digits = m.groups()
+    if hex_digits is not None:
+        value = int(hex_digits, 16)
+    elif bin_digits is not None:
+        value = int(bin_digits, 2)
+    elif oct_digits is not None:
+        value = int(oct_digits, 8)
+    else:
+        value = int(dec_digits)
+    return make_number(-value if sign else value), m.end()
+
+
+def _scan_x(line: str, i: int):
+    m = _xstring_re.match(line, i)
+    if m is not None:
+        return XString(m.group(2)), m.end()
+    return _scan_identifier(line, i)
+
+
+def _scan_c(line: str, i: int):
+    if i + 1 < len(line) and line[i + 1] in "'\"":
+        scanned = scan_cstring(line, i)
+        return (CString(scanned[0]), scanned[1]) if scanned else None
+    return _scan_identifier(line, i)
+
+
+def _scan_relative(line: str, i: int):
+    m = _identifier_re.match(line, i + 1)
+    if m is None:
+        return None
+    return RelativeIdentifier(m.group()), m.end()
+
+
+_operand_scanners = {ch: _scan_identifier for ch in "ABCDEFGHIJKLMNOPQSTUVWXYZ_"}
+_operand_scanners.update({ch: _scan_identifier for ch in "abdefghijklmnopqstuvwyz"})
+_operand_scanners.update({ch: _scan_number for ch in "-0123456789"})
+_operand_scanners.update({"R": _scan_register, "r": _scan_register})
+_operand_scanners.update({"x": _scan_x, "c": _scan_c, "@": _scan_relative})
+
+
+def fast_parse_line(line: str):
+    n = len(line)
+    i = _spaces_re.match(line).end()
+    if i == n or line[i] == ";":
+        return None
+
+    m = _identifier_re.match(line, i)
+    if m is None:
+        return UNCLASSIFIED
+    label = None
+    if m.end() < n and line[m.end()] == ":":
+        label = m.group()
+        m = _identifier_re.match(line, _spaces_re.match(line, m.end() + 1).end())
+        if m is None:
+            return UNCLASSIFIED
+    mnemonic = m.group()
+    i = _spaces_re.match(line, m.end()).end()
+
+    operands = []
+    if i < n and line[i] != ";":
+        while True:
+            scanner = _operand_scanners.get(line[i]) if i < n else None
+            scanned = scanner(line, i) if scanner else None
+            if scanned is None:
+                return UNCLASSIFIED
+            operand, i = scanned
+            operands.append(operand)
+            if i < n and line[i] == ",":
+                i = _spaces_re.match(line, i + 1).end()
+                continue
+            i = _spaces_re.match(line, i).end()
+            if i < n and line[i] != ";":
+                return UNCLASSIFIED
+            break
+
+    return ParsedLine(label, ParsedCommand(mnemonic, operands))
+
+
+def parse_line(line: str) -> ParsedLine | None:
+    result = fast_parse_line(line)
+    if result is UNCLASSIFIED:
+        return line_parser.parse(line)
+    return result
+
+
+# Меняется при любом изменении грамматики или представления строк,
+# по нему инвалидируются сохранённые результаты разбора (parse_cache)
+GRAMMAR_VERSION = 1
+
+
+# Компактное представление разобранных строк кортежами из str/int:
+# (метка, мнемоника, ((код вида операнда, значение), ...)).
+# Используется для передачи результатов между процессами.
+OPERAND_KINDS = (
+    (Identifier, "data", Identifier),
+    (RelativeIdentifier, "data", RelativeIdentifier),
+    (Number, "value", make_number),
+    (Register, "reg", make_register),
+    (CString, "data", CString),
+    (XString, "data", XString),
+)
+_operand_codes = {cls: (code, attr) for code, (cls, attr, _) in enumerate(OPERAND_KINDS)}
+
+
+def encode_parsed_lines(lines: List[ParsedLine]) -> Tuple[tuple, ...]:
+    encoded = []
+    for line in lines:
+        ops = []
+        for op in line.command.operands:
+            code, attr = _operand_codes[type(op)]
+            ops.append((code, getattr(op, attr)))
+        encoded.append((line.label, line.command.mnemonic, tuple(ops)))
+    return tuple(encoded)
+
+
+def decode_parsed_lines(encoded: Iterable[tuple]) -> List[ParsedLine]:
+    # Одинаковые строки исходника разделяют один объект ParsedLine
+    memo = {}
     results = []
-
-    for i, line in enumerate(lines, 1):
+    for item in encoded:
+        line = memo.get(item)
+        if line is None:
+            label, mnemonic, ops = item
+            operands = [OPERAND_KINDS[code][2](value) for code, value in ops]
+            line = memo[item] = ParsedLine(label, ParsedCommand(mnemonic, operands))
+        results.append(line)
+    return results
+
+
+def iter_parse_assembly(
+    source: str | Iterable[str], first_line: int = 1
+) -> Iterator[Tuple[int, ParsedLine | str]]:
+    """Ленивый разбор: (номер строки, ParsedLine или текст ошибки).
+
+    Принимает строку, текстовый файл или любой итератор строк, пустые строки
+    и комментарии пропускаются."""
+    if isinstance(source, str):
+        source = source.split("\n")
+
+    for i, line in enumerate(source, first_line):
+        if line.endswith("\n"):
+            line = line[:-1]
         try:
-            result = line_parser.parse(line)
+            result = parse_line(line)
             if result is not None:
-                results.append(result)
+                yield (i, result)
         except ParseError as err:
-            errors.append(f"Line {i}: '{line.strip()} --- {err}'")
+            yield (i, f"Line {i}: '{line.strip()} --- {err}'")
+
+
+def _parse_chunk(first_line: int, source: str) -> Tuple[List[ParsedLine], List[str]]:
+    errors = []
+    results = []
+
+    for _, entry in iter_parse_assembly(source, first_line):
+        if isinstance(entry, str):
+            errors.append(entry)
+        else:
+            results.append(entry)
+
+    return (results, errors)
+
+
+def _parse_chunk_encoded(first_line: int, source: str) -> Tuple[tuple, List[str]]:
+    results, errors = _parse_chunk(first_line, source)
+    return (encode_parsed_lines(results), errors)
+
+
+def parse_assembly(source: str) -> Tuple[List[ParsedLine], List[str]]:
+    return _parse_chunk(1, source)
+
+
+# Ниже этого числа строк запуск процессов дороже самого разбора
+PARALLEL_THRESHOLD = 100_000
+PARALLEL_CHUNK = 20_000
+
+
+def parse_assembly_parallel(
+    source: str,
+    workers: int | None = None,
+    threshold: int = PARALLEL_THRESHOLD,
+    chunk_size: int = PARALLEL_CHUNK,
+) -> Tuple[List[ParsedLine], List[str]]:
+    """Разбор больших исходников в пуле процессов, результат как у parse_assembly"""
+    lines = source.split("\n")
+    if len(lines) < threshold:
+        return _parse_chunk(1, source)
+
+    workers = workers or os.cpu_count() or 1
+    # Не меньше нескольких кусков на процесс, чтобы выровнять нагрузку
+    chunk_size = max(1, min(chunk_size, len(lines) // (workers * 4) or 1))
+    starts = range(0, len(lines), chunk_size)
+    chunks = ("\n".join(lines[i : i + chunk_size]) for i in starts)
+
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results, chunk_errors in executor.map(
+            _parse_chunk_encoded, (i + 1 for i in starts), chunks
+        ):
+            results.extend(decode_parsed_lines(chunk_results))
+            errors.extend(chunk_errors)
 
     return (results, errors)
+
+
+def _is_parsed(entry: ParsedLine | ParseError | None) -> bool:
+    return entry is not None and not isinstance(entry, ParseError)
+
+
+def _qt_length(line: str) -> int:
+    """Длина строки в позициях QTextDocument (UTF-16)"""
+    return len(line) if line.isascii() else len(line.encode("utf-16-le")) // 2
+
+
+class IncrementalParser:
+    """Инкрементальный разбор: повторно разбираются только изменившиеся строки,
+    списки results и errors правятся на месте в пределах правки"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+        # Для каждой строки исходника: ParsedLine, None (пустая строка) или ParseError
+        self.entries: List[ParsedLine | ParseError | None] = []
+        self.cache: Dict[str, ParsedLine | ParseError | None] = {}
+        # Итог как у parse_assembly
+        self.results: List[ParsedLine] = []
+        # Ошибки: текст без номера строки и номер строки. Номера ниже прошлой
+        # правки сдвигаются лениво: у error_lines[i] для i >= shift_from
+        # настоящий номер на shift больше
+        self.error_texts: List[str] = []
+        self.error_lines: List[int] = []
+        self.shift_from = 0
+        self.shift = 0
+        self._errors: List[str] | None = []
+        # Место прошлой правки: (строка, число результатов до неё). Правки
+        # обычно рядом, поэтому позиция в results ищется от него
+        self.cursor = (0, 0)
+
+    def parse_cached(self, line: str) -> ParsedLine | ParseError | None:
+        if line in self.cache:
+            return self.cache[line]
+        try:
+            entry = parse_line(line)
+        except ParseError as err:
+            entry = err
+        self.cache[line] = entry
+        return entry
+
+    @property
+    def errors(self) -> List[str]:
+        """Тексты ошибок как у parse_assembly, номера строк подставляются при чтении"""
+        if self._errors is None:
+            lines, texts = self.error_lines, self.error_texts
+            split, shift = self.shift_from, self.shift
+            self._errors = [f"Line {n + 1}: {text}" for n, text in zip(lines[:split], texts)]
+            self._errors += [
+                f"Line {n + shift + 1}: {text}" for n, text in zip(lines[split:], texts[split:])
+            ]
+        return self._errors
+
+    def _error_line(self, i: int) -> int:
+        return self.error_lines[i] + (self.shift if i >= self.shift_from else 0)
+
+    def _error_index(self, line: int) -> int:
+        """bisect_left по настоящим номерам строк ошибок"""
+        low, high = 0, len(self.error_lines)
+        while low < high:
+            middle = (low + high) // 2
+            if self._error_line(middle) < line:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _move_shift(self, inx: int) -> None:
+        """Граница ленивого сдвига переносится на inx: правятся только номера
+        между старой и новой границей"""
+        lines, shift, split = self.error_lines, self.shift, self.shift_from
+        if shift:
+            for i in range(split, inx):
+                lines[i] += shift
+            for i in range(inx, split):
+                lines[i] -= shift
+        self.shift_from = inx
+
+    def _results_before(self, line: int) -> int:
+        """Число разобранных строк до line, от места прошлой правки"""
+        cursor, count = self.cursor
+        entries = self.entries
+        if cursor <= line:
+            return count + sum(map(_is_parsed, entries[cursor:line]))
+        return count - sum(map(_is_parsed, entries[line:cursor]))
+
+    def lines_spanned(self, first: int, column: int, chars: int) -> int:
+        """Сколько строк текущего текста задевает удаление chars символов
+        с позиции column строки first (позиции как в QTextDocument)"""
+        lines = self.lines
+        inx = first
+        remaining = column + chars
+        while inx < len(lines) - 1 and remaining > _qt_length(lines[inx]):
+            remaining -= _qt_length(lines[inx]) + 1
+            inx += 1
+        return inx - first + 1
+
+    def edit(self, first: int, removed: int, lines: List[str]) -> None:
+        """Замена строк [first, first + removed) на lines"""
+        end = first + removed
+        before = self._results_before(first)
+        old = self.entries[first:end]
+        entries = [self.parse_cached(line) for line in lines]
+
+        removed_results = sum(map(_is_parsed, old))
+        self.results[before : before + removed_results] = list(filter(_is_parsed, entries))
+        self.lines[first:end] = lines
+        self.entries[first:end] = entries
+
+        errors_from = self._error_index(first)
+        errors_to = self._error_index(end)
+        self._move_shift(errors_to)
+        new_errors = [i for i, entry in enumerate(entries) if isinstance(entry, ParseError)]
+        self.error_lines[errors_from:errors_to] = [first + i for i in new_errors]
+        self.error_texts[errors_from:errors_to] = [
+            f"'{lines[i].strip()} --- {entries[i]}'" for i in new_errors
+        ]
+        # Номера строк ниже правки сдвинутся при чтении errors
+        self.shift_from = errors_from + len(new_errors)
+        self.shift += len(lines) - removed
+        self._errors = None
+        self.cursor = (first, before)
+
+        # Кэш не должен расти бесконечно при долгом редактировании
+        if len(self.cache) > 2 * len(self.lines) + 1024:
+            self.cache = dict(zip(self.lines, self.entries))
+
+    def update(self, source: str) -> None:
+        """Правка по всему новому тексту: изменённый участок ищется сравнением"""
+        lines = source.split("\n")
+        old = self.lines
+        # Общие начало и конец старого и нового текста не разбираются заново
+        limit = min(len(old), len(lines))
+        prefix = 0
+        while prefix < limit and old[prefix] == lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < limit - prefix
+            and old[len(old) - 1 - suffix] == lines[len(lines) - 1 - suffix]
+        ):
+            suffix += 1
+        self.edit(prefix, len(old) - suffix - prefix, lines[prefix : len(lines) - suffix])
+
+    def parse(self, source: str) -> Tuple[List[ParsedLine], List[str]]:
+        self.update(source)
+        return (self.results, self.errors)
@@ -0,0 +1,148 @@
+# Профилирование симулятора: счётчики исполнения по адресам и кодам операций
+# в array('I') и отчёт о горячих местах с привязкой к строкам исходника.
+# Счётчики вшиваются в команды при декодировании (и в текст блоков), поэтому
+# без профиля симулятор работает как обычно.
+from array import array
+from bisect import bisect_right
+
+from loader import *
+from first_pass import ListingLine
+
+# Код операции занимает 6 бит
+OPCODES = 64
+
+
+class Profile:
+    """Счётчики исполнения по адресам [low, high) и по кодам операций"""
+
+    def __init__(self, low: int, high: int, sections: Iterable[Tuple[int, str]] = ()):
+        self.low = low
+        self.high = high
+        self.hits = array("I", bytes(4 * (high - low)))
+        self.opcodes = array("I", bytes(4 * OPCODES))
+        # Адреса загрузки и имена секций по возрастанию адреса
+        ordered = sorted(sections)
+        self.starts = [adr for adr, _ in ordered]
+        self.names = [name for _, name in ordered]
+
+    @classmethod
+    def for_program(cls, loaded: LoadResult) -> "Profile":
+        """Профиль на весь образ загруженной программы"""
+        return cls(
+            loaded.start,
+            loaded.start + len(loaded.memory),
+            ((item.address, item.name) for item in loaded.sections),
+        )
+
+    def counting(self, execute: Callable, adr: int, opcode: int) -> Callable:
+        """Обёртка семантики команды для интерпретатора"""
+        opcodes = self.opcodes
+        if not (self.low <= adr < self.high):
+            def counted(cpu, ins):
+                opcodes[opcode] += 1
+                return execute(cpu, ins)
+            return counted
+
+        hits = self.hits
+        inx = adr - self.low
+
+        def counted(cpu, ins):
+            hits[inx] += 1
+            opcodes[opcode] += 1
+            return execute(cpu, ins)
+
+        return counted
+
+    def source(self, adr: int, opcode: int) -> str:
+        """Текст счётчиков команды для скомпилированного блока"""
+        if not (self.low <= adr < self.high):
+            return f"opcodes[{opcode}] += 1"
+        return f"hits[{adr - self.low}] += 1\nopcodes[{opcode}] += 1"
+
+    def namespace(self) -> Dict[str, array]:
+        return {"hits": self.hits, "opcodes": self.opcodes}
+
+    def clear(self) -> None:
+        # Массивы обнуляются на месте: на них ссылаются декодированные команды
+        self.hits[:] = array("I", bytes(4 * len(self.hits)))
+        self.opcodes[:] = array("I", bytes(4 * OPCODES))
+
+    @property
+    def total(self) -> int:
+        return sum(self.opcodes)
+
+    def section_of(self, adr: int) -> str | None:
+        inx = bisect_right(self.starts, adr) - 1
+        return self.names[inx] if inx >= 0 else None
+
+    def section_counts(self) -> Dict[str, int]:
+        """Исполнено команд по секциям (имена из записей H)"""
+        counts = dict.fromkeys(self.names, 0)
+        for inx, count in enumerate(self.hits):
+            if count and (name := self.section_of(self.low + inx)) is not None:
+                counts[name] += count
+        return counts
+
+    def opcode_counts(self, op_table: Dict[str, Tuple[int, int]]) -> Dict[str, int]:
+        """Исполнено команд по мнемоникам"""
+        return {
+            mnemonic: self.opcodes[opcode]
+            for mnemonic, (opcode, _) in op_table.items()
+            if self.opcodes[opcode]
+        }
+
+    def hot_spots(self, limit: int = 10) -> List[Tuple[int, int]]:
+        """(адрес, счётчик) самых часто исполняемых команд"""
+        spots = [(count, inx) for inx, count in enumerate(self.hits) if count]
+        spots.sort(reverse=True)
+        return [(self.low + inx, count) for count, inx in spots[:limit]]
+
+
+def _labels(symbol_table: SymbolTable | None) -> Dict[str, Tuple[List[int], List[str]]]:
+    """Метки секций по возрастанию адреса: секция -> (адреса, имена)"""
+    labels = {}
+    if symbol_table is None:
+        return labels
+    for section, symbols in symbol_table.sections.items():
+        pairs = sorted(
+            (symbol.addr, symbol.name)
+            for symbol in symbols.values()
+            if symbol.addr is not None and symbol.type is not SymbolType.EXTREF
+        )
+        labels[section] = ([adr for adr, _ in pairs], [name for _, name in pairs])
+    return labels
+
+
+def hot_spot_report(
+    profile: Profile,
+    loaded: LoadResult,
+    listing: List[ListingLine] | None = None,
+    symbol_table: SymbolTable | None = None,
+    limit: int = 10,
+) -> List[str]:
+    """Отчёт о горячих местах: адрес загрузки, счётчик, доля, секция и
+    ближайшая метка, строка исходника (по листингу первого прохода)"""
+    total = profile.total or 1
+    deltas = {item.name: item.delta for item in loaded.sections}
+    by_address = {(line.section, line.adr): line for line in listing or ()}
+    labels = _labels(symbol_table)
+
+    report = [f"Всего команд: {profile.total}"]
+    for adr, count in profile.hot_spots(limit):
+        name = profile.section_of(adr)
+        place = ""
+        text = ""
+        if name is not None:
+            # Адрес при ассемблировании
+            asm_adr = adr - deltas.get(name, 0)
+            place = f"{name}:{asm_adr:06X}"
+            if name in labels:
+                addrs, names = labels[name]
+                if (inx := bisect_right(addrs, asm_adr) - 1) >= 0:
+                    offset = asm_adr - addrs[inx]
+                    place = f"{name}:{names[inx]}" + (f"+{offset:X}" if offset else "")
+            if (line := by_address.get((name, asm_adr))) is not None:
+                number = f"{line.number}: " if line.number is not None else ""
+                text = f"{number}{line.line}"
+        report.append(f"{adr:06X} {count:>10} {100 * count / total:5.1f}% {place:<16} {text}")
+    return report
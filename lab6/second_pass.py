@@ -1,4 +1,6 @@
 from lexems import *
+from boundary_index import BoundaryIndex
+from object_code import *
 from pprint import pprint
 from itertools import groupby
 
@@ -14,62 +16,18 @@ class AddressFormat:
     MOVABLE = 1
 
 
-def address_type(ops: List[Operand]) -> int:
-    if any(isinstance(op, RelativeIdentifier) for op in ops):
+def address_type(signature: Tuple[type, ...]) -> int:
+    if RelativeIdentifier in signature:
         return AddressType.RELATIVE
-    if any(isinstance(op, Identifier) for op in ops):
+    if Identifier in signature:
         return AddressType.DIRECT
     return AddressType.IMMEDIATE
     # return int(any(isinstance(op, Identifier) for op in ops))
 
 
-def display_value(ops: List[Operand], symbol_table, section, expected_size, idr) -> str:
-    vals = [op.resolve_value(symbol_table, section, idr) for op in ops]
-    try:
-        if expected_size == 1:
-            return ""
-        strs_pattern = match_op_pattern(ops, XString) or match_op_pattern(ops, CString)
-        if expected_size == 2:
-            if match_op_pattern(ops, Register, Register):
-                return "".join(f"{val:01x}" for val in vals)
-            if match_op_pattern(ops, Number) or strs_pattern:
-                return "".join(f"{val:02x}" for val in vals)
-        if expected_size == 3:
-            if match_op_pattern(ops, RelativeIdentifier):
-                return "".join(f"{val:04X}" for val in vals)
-        if expected_size == 4 or strs_pattern:
-            return "".join(f"{val:06X}" for val in vals)
-    except:
-        return "".join(str(val) for val in vals)
-
-
-def byte_display(ops: List[Operand]):
-    if match_op_pattern(ops, Number):
-        val = ops[0].resolve_value()
-        return f"{val:02x}"
-    if match_op_pattern(ops, CString):
-        val = ops[0].data
-        return "".join(f"{ord(c):02x}" for c in val)
-    if match_op_pattern(ops, XString):
-        val = ops[0].data
-        return "0" * ((2 - (len(val) % 2)) % 2) + val
-
-
-def word_display(ops: List[Operand]):
-    if match_op_pattern(ops, Number):
-        val = ops[0].resolve_value()
-        return f"{val:06X}"
-    if match_op_pattern(ops, CString):
-        val = ops[0].data
-        return "".join(f"{ord(c):06X}" for c in val)
-    if match_op_pattern(ops, XString):
-        val = ops[0].data
-        return "0" * ((6 - (len(val) % 6)) % 6) + val
-
-
 def second_pass(
     auxalirity_table: List[Tuple[int, ParsedLine]],
-    symbol_table: Dict[str, Dict[str, Any]],
+    symbol_table: SymbolTable,
     op_table_dict: Dict[str, Tuple[int, int]],
 ) -> Tuple[List[str], List[str], List[Tuple[int, str, str]]]:
     machine_code = []
@@ -88,12 +46,13 @@ def second_pass(
         _, (last_loc, _, _) = section[-1]
         _, (first_loc, _, _) = section[0]
         prog_size = last_loc - first_loc
+        boundaries = BoundaryIndex(loc for _, (loc, _, _) in section)
+        symbols = symbol_table.sections.get(section_name, {})
         section_modification_table: List[(int, str)] = []
         def write_mod_table():
             print(section_modification_table)
             for loc, name in section_modification_table:
-                symbol = symbol_table[section_name][name]
-                if symbol["type"] == "EXTREF":
+                if symbols[name].type is SymbolType.EXTREF:
                     machine_code.append(f"M {loc:06X} {name}")
                 else:
                     machine_code.append(f"M {loc:06X}")
@@ -105,6 +64,7 @@ def second_pass(
             )
             mnemonic = line.command.mnemonic
             ops = line.command.operands
+            signature = line.command.signature
             # if mnemonic in ["[ESECT]"]:
             #     write_mod_table()
             #     print(line)
@@ -112,9 +72,9 @@ def second_pass(
             if mnemonic in ["[ESECT]", "END"]:
                 write_mod_table()
                 load_address = first_loc
-                if match_op_pattern(ops, Number):
+                if signature == (Number,):
                     load_address = ops[0].resolve_value()
-                if load_address not in [loc for _, (loc, _, _) in section]:
+                if load_address not in boundaries:
                     lineErr("Некорректный адрес точки входа")
                 machine_code.append(f"E {0:06X}")
             if mnemonic == "START":
@@ -126,32 +86,32 @@ def second_pass(
             if mnemonic == "CSECT":
                 machine_code.append(f"H {line.label} {location:06X} {prog_size:X}")
             if mnemonic == "BYTE":
-                machine_code.append(f"T {location:06X} {dlta} {byte_display(ops)}")
+                data = byte_data(ops) or b""
+                machine_code.append(f"T {location:06X} {dlta} {hex_text(data)}")
             if mnemonic == "WORD":
-                machine_code.append(f"T {location:06X} {dlta} {word_display(ops)}")
+                data = word_data(ops) or b""
+                machine_code.append(f"T {location:06X} {dlta} {hex_text(data)}")
 
-            try:
-                if mnemonic == "EXTDEF":
-                    val = display_value(
-                        ops, symbol_table, section_name, 4, location + dlta
-                    )
-                    machine_code.append(f"D {ops[0]} {val}")
-                if mnemonic in op_table_dict:
-                    opcode, expected_size = op_table_dict[mnemonic]
-                    addrtype = address_type(ops)
-
-                    op_adr_code = (opcode << 2) | addrtype
-                    op_disp_val = display_value(
-                        ops, symbol_table, section_name, expected_size, location + dlta
-                    )
-                    machine_code.append(
-                        f"T {location:06X} {dlta} {op_adr_code:02X}{op_disp_val}"
-                    )
-                    if address_type(ops) == AddressType.DIRECT:
-                        for op in ops:
-                            section_modification_table.append((location, str(op)))
-            except Exception as err:
-                lineErr(str(err))
+            if mnemonic == "EXTDEF":
+                vals, unresolved = resolve_operands(ops, symbols, location + dlta)
+                if unresolved is not None:
+                    lineErr(unresolved.error)
+                else:
+                    machine_code.append(f"D {ops[0]} {hex_text(operand_bytes(4, vals))}")
+            if mnemonic in op_table_dict:
+                opcode, expected_size = op_table_dict[mnemonic]
+                addrtype = address_type(signature)
+
+                op_adr_code = (opcode << 2) | addrtype
+                vals, unresolved = resolve_operands(ops, symbols, location + dlta)
+                if unresolved is not None:
+                    lineErr(unresolved.error)
+                    continue
+                code = encode_instruction(op_adr_code, expected_size, vals)
+                machine_code.append(f"T {location:06X} {dlta} {hex_text(code)}")
+                if addrtype == AddressType.DIRECT:
+                    for op in ops:
+                        section_modification_table.append((location, str(op)))
     
     print(modification_table)
 
@@ -0,0 +1,382 @@
+# Симулятор системы команд: исполняет загруженный код из образа памяти.
+# Первый байт команды — (код операции << 2) | способ адресации, размер и
+# мнемоника берутся из таблицы кодов операций. Команда декодируется один
+# раз, кэш по адресу сбрасывается только при записи в байты кода.
+import re
+from time import perf_counter
+
+from lexems import *
+from memory_image import MemoryImage
+
+WORD_MASK = 0xFFFFFF
+REGISTERS = 16
+# Аккумулятор — регистр R0
+ACC = 0
+
+# Страницы памяти для снимков состояния
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+# Ненулевые байты XOR сохранённой и текущей страницы — изменённые участки
+_NONZERO = re.compile(rb"[^\x00]+")
+
+# Способы адресации (как AddressType в first_pass)
+IMMEDIATE = 0
+DIRECT = 1
+RELATIVE = 2
+
+
+def signed(value: int, bits: int) -> int:
+    """Значение из bits бит в дополнительном коде"""
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+
+@dataclass(slots=True)
+class Decoded:
+    """Декодированная команда из кэша"""
+
+    adr: int
+    size: int
+    mnemonic: str
+    opcode: int
+    mode: int
+    # Поле операндов целиком
+    operand: int
+    # Исполнительный адрес (для прямой и относительной адресации)
+    target: int | None
+    # Номера регистров у команд вида R1, R2
+    ra: int
+    rb: int
+    # Адрес следующей команды
+    next: int
+    execute: Callable[["Simulator", "Decoded"], int | None]
+
+
+# Семантика команд по мнемонике: execute(cpu, ins) -> адрес следующей
+# команды или None для останова
+SEMANTICS: Dict[str, Callable] = {}
+# Варианты для 2-байтных команд с двумя регистрами
+REGISTER_SEMANTICS: Dict[str, Callable] = {}
+
+
+def semantics(*mnemonics: str, registers: bool = False):
+    """Декоратор для добавления семантики команд"""
+
+    def register(execute):
+        table = REGISTER_SEMANTICS if registers else SEMANTICS
+        for mnemonic in mnemonics:
+            table[mnemonic] = execute
+        return execute
+
+    return register
+
+
+def _value(cpu: "Simulator", ins: Decoded) -> int:
+    """Непосредственный операнд или слово по исполнительному адресу"""
+    if ins.target is None:
+        return ins.operand
+    return cpu.memory.read24(ins.target)
+
+
+def _address(ins: Decoded) -> int:
+    if ins.target is None:
+        raise ValueError(f"Команде {ins.mnemonic} нужен адрес, а не непосредственный операнд")
+    return ins.target
+
+
+@semantics("LOAD", "LOADI")
+def op_load(cpu, ins):
+    cpu.registers[ACC] = _value(cpu, ins)
+    return ins.next
+
+
+@semantics("STORE")
+def op_store(cpu, ins):
+    cpu.store(_address(ins), cpu.registers[ACC])
+    return ins.next
+
+
+@semantics("ADD")
+def op_add(cpu, ins):
+    regs = cpu.registers
+    regs[ACC] = (regs[ACC] + _value(cpu, ins)) & WORD_MASK
+    return ins.next
+
+
+@semantics("SUB")
+def op_sub(cpu, ins):
+    regs = cpu.registers
+    regs[ACC] = (regs[ACC] - _value(cpu, ins)) & WORD_MASK
+    return ins.next
+
+
+@semantics("COMP")
+def op_comp(cpu, ins):
+    diff = signed(cpu.registers[ACC], 24) - signed(_value(cpu, ins), 24)
+    cpu.cc = (diff > 0) - (diff < 0)
+    return ins.next
+
+
+@semantics("ADD", registers=True)
+def op_add_registers(cpu, ins):
+    regs = cpu.registers
+    regs[ins.ra] = (regs[ins.ra] + regs[ins.rb]) & WORD_MASK
+    return ins.next
+
+
+@semantics("SUB", registers=True)
+def op_sub_registers(cpu, ins):
+    regs = cpu.registers
+    regs[ins.ra] = (regs[ins.ra] - regs[ins.rb]) & WORD_MASK
+    return ins.next
+
+
+@semantics("MOV", registers=True)
+def op_mov_registers(cpu, ins):
+    cpu.registers[ins.ra] = cpu.registers[ins.rb]
+    return ins.next
+
+
+@semantics("COMP", registers=True)
+def op_comp_registers(cpu, ins):
+    diff = signed(cpu.registers[ins.ra], 24) - signed(cpu.registers[ins.rb], 24)
+    cpu.cc = (diff > 0) - (diff < 0)
+    return ins.next
+
+
+@semantics("JMP")
+def op_jmp(cpu, ins):
+    return _address(ins)
+
+
+@semantics("JZ")
+def op_jz(cpu, ins):
+    return _address(ins) if cpu.registers[ACC] == 0 else ins.next
+
+
+@semantics("JEQ")
+def op_jeq(cpu, ins):
+    return _address(ins) if cpu.cc == 0 else ins.next
+
+
+@semantics("JLT")
+def op_jlt(cpu, ins):
+    return _address(ins) if cpu.cc < 0 else ins.next
+
+
+@semantics("JGT")
+def op_jgt(cpu, ins):
+    return _address(ins) if cpu.cc > 0 else ins.next
+
+
+@semantics("NOP")
+def op_nop(cpu, ins):
+    return ins.next
+
+
+@semantics("HALT")
+def op_halt(cpu, ins):
+    return None
+
+
+@dataclass(slots=True)
+class Snapshot:
+    """Снимок состояния машины. Память не копируется: после снимка первая
+    запись в страницу сохраняет её прежнее содержимое в pages"""
+
+    registers: List[int]
+    pc: int
+    cc: int
+    # Номер страницы -> содержимое на момент снимка
+    pages: Dict[int, bytes] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class RunResult:
+    # Адрес команды, на которой исполнение остановилось
+    pc: int
+    steps: int
+    elapsed: float
+    halted: bool
+    error: str | None = None
+
+    @property
+    def ips(self) -> float:
+        """Команд в секунду"""
+        return self.steps / self.elapsed if self.elapsed else 0.0
+
+
+class Simulator:
+    """Процессор поверх образа памяти с кэшем декодированных команд"""
+
+    def __init__(self, memory: MemoryImage, op_table: Dict[str, Tuple[int, int]]):
+        self.memory = memory
+        self.registers = [0] * REGISTERS
+        # Результат последнего COMP: -1, 0, 1
+        self.cc = 0
+        self.pc = 0
+        # код операции -> (мнемоника, размер)
+        self.opcodes = {opcode: (mnemonic, size) for mnemonic, (opcode, size) in op_table.items()}
+        self.cache: Dict[int, Decoded] = {}
+        # Байт кода -> адреса команд из кэша, в которые он входит (команды
+        # перекрываются, если переход ведёт в середину другой команды)
+        self.owners: Dict[int, Set[int]] = {}
+        # Границы закэшированного кода: записи вне них не проверяются
+        self.code_low = len(memory)
+        self.code_high = 0
+        self.decodes = 0
+        self.invalidations = 0
+        # Профиль (profiler.Profile): счётчики вшиваются в команды при
+        # декодировании, без профиля цикл исполнения не меняется
+        self.profile = None
+        # Последний снимок: пока он есть, записи сохраняют старые страницы.
+        # Память меняется только через store/write, иначе снимок её не увидит.
+        self.checkpoint: Snapshot | None = None
+
+    def set_profile(self, profile) -> None:
+        """Включение (или выключение, profile=None) профилирования"""
+        self.profile = profile
+        self.invalidate_all()
+
+    def decode(self, adr: int) -> Decoded:
+        first = self.memory.read8(adr)
+        opcode, mode = first >> 2, first & 3
+        if (entry := self.opcodes.get(opcode)) is None:
+            raise ValueError(f"Неизвестный код операции {opcode:02X}")
+        mnemonic, size = entry
+        operand = self.memory.read(adr + 1, size - 1) if size > 1 else 0
+        end = adr + size
+        ra, rb = operand >> 4, operand & 0xF
+        execute = None
+        target = None
+        if mode == DIRECT:
+            target = operand
+        elif mode == RELATIVE:
+            target = (end + signed(operand, 8 * (size - 1))) & WORD_MASK
+        elif mode != IMMEDIATE:
+            raise ValueError(f"Некорректный способ адресации {mode} у команды {mnemonic}")
+        elif size == 2:
+            execute = REGISTER_SEMANTICS.get(mnemonic)
+        if execute is None and (execute := SEMANTICS.get(mnemonic)) is None:
+            raise ValueError(f"Нет семантики для команды {mnemonic}")
+
+        if self.profile is not None:
+            execute = self.profile.counting(execute, adr, opcode)
+
+        ins = Decoded(adr, size, mnemonic, opcode, mode, operand, target, ra, rb, end, execute)
+        self.cache[adr] = ins
+        owners = self.owners
+        for byte in range(adr, end):
+            if (starts := owners.get(byte)) is None:
+                owners[byte] = {adr}
+            else:
+                starts.add(adr)
+        self.code_low = min(self.code_low, adr)
+        self.code_high = max(self.code_high, end)
+        self.decodes += 1
+        return ins
+
+    def invalidate(self, adr: int, length: int) -> None:
+        """Сброс закэшированных команд, пересекающих [adr, adr + length)"""
+        if adr >= self.code_high or adr + length <= self.code_low:
+            return
+        owners = self.owners
+        for byte in range(max(adr, self.code_low), min(adr + length, self.code_high)):
+            for start in owners.pop(byte, ()):
+                ins = self.cache.pop(start)
+                for covered in range(start, ins.next):
+                    if (starts := owners.get(covered)) is not None:
+                        starts.discard(start)
+                        if not starts:
+                            del owners[covered]
+                self.invalidations += 1
+
+    def invalidate_all(self) -> None:
+        self.cache.clear()
+        self.owners.clear()
+        self.code_low, self.code_high = len(self.memory), 0
+
+    def store(self, adr: int, value: int) -> None:
+        """Запись слова из программы"""
+        if self.checkpoint is not None:
+            self.save_pages(adr, 3)
+        self.memory.write24(adr, value)
+        self.invalidate(adr, 3)
+
+    def write(self, adr: int, data: bytes) -> None:
+        """Запись извне (загрузчик, отладчик) с учётом кэша и снимка"""
+        if self.checkpoint is not None and data:
+            self.save_pages(adr, len(data))
+        self.memory.load(adr, data)
+        self.invalidate(adr, len(data))
+
+    def save_pages(self, adr: int, length: int) -> None:
+        """Сохраняет в снимок ещё не тронутые страницы [adr, adr + length)"""
+        pages = self.checkpoint.pages
+        memory = self.memory.map
+        for page in range(adr >> PAGE_BITS, ((adr + length - 1) >> PAGE_BITS) + 1):
+            if page not in pages:
+                start = page << PAGE_BITS
+                pages[page] = memory[start : start + PAGE_SIZE]
+
+    def snapshot(self) -> Snapshot:
+        """Снимок регистров и памяти; прежний снимок перестаёт действовать"""
+        self.checkpoint = Snapshot(list(self.registers), self.pc, self.cc)
+        return self.checkpoint
+
+    def restore(self, snapshot: Snapshot | None = None) -> int:
+        """Возврат к последнему снимку, снимок остаётся действующим.
+        Возвращает число восстановленных страниц."""
+        checkpoint = self.checkpoint
+        if checkpoint is None or (snapshot is not None and snapshot is not checkpoint):
+            raise ValueError("Можно вернуться только к последнему снимку")
+        memory = self.memory
+        for page, data in checkpoint.pages.items():
+            start = page << PAGE_BITS
+            # Кэш сбрасывается только по байтам кода, которые действительно
+            # изменились: данные между командами его не трогают
+            low = max(self.code_low - start, 0)
+            high = min(self.code_high - start, len(data))
+            changed = ()
+            if low < high and (current := memory.map[start + low : start + high]) != data[low:high]:
+                diff = int.from_bytes(current, "big") ^ int.from_bytes(data[low:high], "big")
+                changed = [m.span() for m in _NONZERO.finditer(diff.to_bytes(high - low, "big"))]
+            memory.load(start, data)
+            for first, end in changed:
+                self.invalidate(start + low + first, end - first)
+        restored = len(checkpoint.pages)
+        checkpoint.pages.clear()
+        # Список регистров меняется на месте: на него ссылается цикл run
+        self.registers[:] = checkpoint.registers
+        self.pc = checkpoint.pc
+        self.cc = checkpoint.cc
+        return restored
+
+    def run(self, entry: int | None = None, max_steps: int = 10_000_000) -> RunResult:
+        """Исполнение с адреса entry (или текущего pc) до HALT, ошибки или
+        max_steps команд"""
+        pc = self.pc if entry is None else entry
+        cache = self.cache
+        decode = self.decode
+        steps = 0
+        halted = False
+        error = None
+        begin = perf_counter()
+        try:
+            while steps < max_steps:
+                ins = cache.get(pc)
+                if ins is None:
+                    ins = decode(pc)
+                next_pc = ins.execute(self, ins)
+                steps += 1
+                if next_pc is None:
+                    halted = True
+                    break
+                pc = next_pc
+        except (ValueError, IndexError) as e:
+            error = f"[{pc:06X}]: {e}"
+        elapsed = perf_counter() - begin
+        self.pc = pc
+        if error is None and not halted:
+            error = f"[{pc:06X}]: Превышено число шагов {max_steps}"
+        return RunResult(pc, steps, elapsed, halted, error)
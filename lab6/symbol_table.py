@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import *
+
+
+class SymbolType(Enum):
+    # Значение показывается в таблице символических имён
+    LOCAL = ""
+    EXTDEF = "EXTDEF"
+    EXTREF = "EXTREF"
+
+
+# Доступ к члену Enum через класс заметно дороже чтения глобального имени
+_EXTREF = SymbolType.EXTREF
+
+
+@dataclass(slots=True)
+class Symbol:
+    name: str
+    section: str
+    type: SymbolType = SymbolType.LOCAL
+    addr: int | None = None
+
+    @property
+    def resolved(self) -> bool:
+        """Значение известно: адрес определён или имя внешнее"""
+        return self.addr is not None or self.type is _EXTREF
+
+
+class SymbolTable:
+    """Таблица символических имён: индекс по секциям и общий индекс EXTDEF"""
+
+    __slots__ = ("sections", "exports")
+
+    def __init__(self):
+        self.sections: Dict[str, Dict[str, Symbol]] = {}
+        self.exports: Dict[str, Symbol] = {}
+
+    def __len__(self) -> int:
+        return sum(map(len, self.sections.values()))
+
+    def open_section(self, section: str) -> Dict[str, Symbol]:
+        symbols = self.sections[section] = {}
+        return symbols
+
+    def get(self, section: str, name: str) -> Symbol | None:
+        symbols = self.sections.get(section)
+        return symbols.get(name) if symbols is not None else None
+
+    def add(self, symbol: Symbol) -> Symbol:
+        """Добавляет или заменяет запись в секции symbol.section"""
+        self.sections.setdefault(symbol.section, {})[symbol.name] = symbol
+        if symbol.type is SymbolType.EXTDEF:
+            self.exports.setdefault(symbol.name, symbol)
+        return symbol
+
+    def declare(self, section: str, name: str) -> Symbol:
+        """Запись имени в секции, новая заводится локальной без адреса"""
+        symbol = self.get(section, name)
+        if symbol is None:
+            symbol = self.add(Symbol(name, section))
+        return symbol
+
+    def export(self, symbol: Symbol) -> None:
+        symbol.type = SymbolType.EXTDEF
+        self.exports.setdefault(symbol.name, symbol)
+
+    def undefined(self, section: str | None = None) -> List[Symbol]:
+        """Имена без адреса (кроме EXTREF) в секции или во всей таблице"""
+        if section is None:
+            sections = self.sections.values()
+        else:
+            sections = (self.sections.get(section, {}),)
+        return [
+            symbol
+            for symbols in sections
+            for symbol in symbols.values()
+            if not symbol.resolved
+        ]